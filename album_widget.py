@@ -7,18 +7,14 @@ from item_models import AlbumModel
 #############################################################################
 
 class AlbumWidget(_WidgetTemplate):
+
+    SNAPSHOT_KIND = 'albums'
+
     def __init__(self, parent):
         super().__init__(parent)
 
         # album data
-        self.wTableModelA = AlbumModel()
-        self.wTableViewA.setModel(self.wTableModelA)
-
-        self.wTableModelB = AlbumModel()
-        self.wTableViewB.setModel(self.wTableModelB)
-
-        self.wTableModelA.setSiblingModel(self.wTableModelB)
-        self.wTableModelB.setSiblingModel(self.wTableModelA)
+        self.setModels(AlbumModel(), AlbumModel())
 
         # layout
         self.wLayout = QHBoxLayout()
@@ -30,22 +26,24 @@ class AlbumWidget(_WidgetTemplate):
 
     def _loadData(self, app, view: QTableView):
 
-        model = view.model()
+        model = self.modelOf(view)
         model.clear()
         
         self.parent.busy()
         print(f"\nLoading {app.name} albums ...")
-        
-        items = app.get_saved_albums()
-        albums = sorted(items, key=lambda x: x.sortKey())
 
-        print(f"=> Albums ({len(albums)}):")
-        for album in albums:
-            print(f"Loaded album: {album.name}")
-            model.add(album)
+        self._loadPages(app, view, self._iterPages(app))
+
+    def _iterPages(self, app):
+        return app.iter_saved_albums(incremental=True)
 
-        self.wTableModelA.layoutChanged.emit()
-        self.wTableModelB.layoutChanged.emit()
+    def _loadFinished(self, app, view: QTableView):
+
+        model = self.modelOf(view)
+
+        print(f"=> Albums ({len(model.items)}):")
+        for album in model.items:
+            print(f"Loaded album: {album.name}")
 
         self.parent.showMessage(f"\nLoaded {len(model.items)} albums from {app.name} ...")
         self.parent.done()
@@ -54,13 +52,15 @@ class AlbumWidget(_WidgetTemplate):
                       appA, viewA: QTableView,
                       appB, viewB: QTableView):
 
-        modelA = viewA.model()
-        modelB = viewB.model()
+        modelA = self.modelOf(viewA)
+        modelB = self.modelOf(viewB)
         
         self.parent.busy()
 
         num_items = 0
 
+        restored = self._restoreMappings('album', modelA.items, modelB, appB.get_albums)
+
         for a_album in modelA.items:
             a_name = a_album.simplifiedName()
             a_id = a_album.id
@@ -74,8 +74,9 @@ class AlbumWidget(_WidgetTemplate):
 
             # Re-use known mapping
             b_id = self.parent.mappingTable.find('album', a_id)
-            if b_id:
-                b_album = appB.get_album(b_id)
+            b_album = restored.get(b_id) if b_id else None
+            if b_album:
+                b_name = b_album.simplifiedName()
 
                 print(f"Transfer album: {a_name} ({appA.name}:{a_id}) => {b_name} ({appB.name}:{b_id}) [restored]")
                 b_album.setDirty(True)  # mark as dirty to save later
@@ -83,29 +84,36 @@ class AlbumWidget(_WidgetTemplate):
                 num_items += 1
                 continue
 
+            # Look up by UPC code
+            b_album = appB.find_album_by_upc(a_album.upc) if a_album.upc else None
+            if b_album:
+                b_name = b_album.simplifiedName()
+                b_id = str(b_album.id)
+
+                print(f"Transfer album: {a_name} ({appA.name}:{a_id}) => {b_name} ({appB.name}:{b_id}) [upc]")
+                b_album.setDirty(True)  # mark as dirty to save later
+                modelB.insert(b_album)
+                num_items += 1
+                self.parent.mappingTable.add('album', a_id, b_id)
+                continue
+
             # Search by album name
             query = f"{a_album.artist} - {a_album._name}"
             print("Searching for album:", query)
             result = appB.search_album(query)
 
-            # Find matching album in search results
-            match = False
-            for b_album in result:
+            # Find best matching album in search results
+            b_album, score = self.parent.matcher.bestMatch(a_album, result)
+            match = b_album is not None
+            if match:
                 b_name = b_album.simplifiedName()
+                b_id = str(b_album.id)
 
-                # Must have exact, case-insensitive match
-                if b_album.name.lower() == a_album.name.lower() \
-                        and b_album.artist.lower() == a_album.artist.lower():
-                    b_id = str(b_album.id)
-
-                    print(f"Transfer album: {a_name} ({appA.name}:{a_id}) => {b_name} ({appB.name}:{b_id}) [matched]")
-                    b_album.setDirty(True)  # mark as dirty to save later
-                    modelB.insert(b_album)
-                    num_items += 1
-                    self.parent.mappingTable.add('album', a_id, b_id)
-
-                    match = True
-                    break
+                print(f"Transfer album: {a_name} ({appA.name}:{a_id}) => {b_name} ({appB.name}:{b_id}) [matched {score:.2f}]")
+                b_album.setDirty(True)  # mark as dirty to save later
+                modelB.insert(b_album)
+                num_items += 1
+                self.parent.mappingTable.add('album', a_id, b_id)
 
             if not match:
                 # Allow to manually specify an album id
@@ -136,15 +144,12 @@ class AlbumWidget(_WidgetTemplate):
                 else:
                     return
 
-        self.wTableModelA.layoutChanged.emit()
-        self.wTableModelB.layoutChanged.emit()
-
         self.parent.showMessage(f"\nTransferred {num_items} albums to {appB.name} ...")
         self.parent.done()
 
     def _submitData(self, app, view: QTableView):
 
-        model = view.model()
+        model = self.modelOf(view)
 
         added_albums = []
         for item in model.items:
@@ -159,13 +164,21 @@ class AlbumWidget(_WidgetTemplate):
 
         #print(added_albums)
         print(f"Adding {len(added_albums)} albums to {app.name} ...")
-        app.add_saved_albums(added_albums)
-        
-        dlg = MessageDialog(self, "Success!",
-            f"{len(added_albums)} album(s) were added to {app.name}.")
+        submitted, failed = app.add_saved_albums(added_albums)
+
+        # only confirmed albums are saved, failed ones stay dirty for the next submit
+        for album in submitted:
+            album.setDirty(False)
+        model.updateStatus([ album.simplifiedName() for album in submitted ])
+
+        if failed:
+            dlg = MessageDialog(self, "Warning!",
+                f"{len(submitted)} album(s) were added to {app.name}, {len(failed)} album(s) failed.")
+        else:
+            dlg = MessageDialog(self, "Success!",
+                f"{len(submitted)} album(s) were added to {app.name}.")
         dlg.exec()
 
-        self._loadData(app, view)
-        
-        self.parent.showMessage(f"\nSubmitted {len(added_albums)} albums to {app.name} ...")
+        self.parent.showMessage(f"\nSubmitted {len(submitted)} albums to {app.name} ...")
+
         self.parent.done()
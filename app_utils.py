@@ -0,0 +1,341 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor
+
+#############################################################################
+
+MAX_WORKERS = 4  # concurrent requests per provider
+ITEM_ERROR_STATUS = frozenset([ 400, 404 ])  # requests rejected because of their content
+FULL_RELOAD_INTERVAL = 6 * 3600  # seconds between full reloads of saved items
+
+def fetch_pages(fetch, page_size: int, total: int = None, max_workers: int = MAX_WORKERS):
+    """Yield all pages of an offset-paginated API endpoint in order.
+
+    If the `total` number of items is not given, `fetch(offset)` must return
+    a page dict containing it; the first page is then fetched directly. All
+    remaining offsets are fetched concurrently, with at most a few pages read
+    ahead of the consumer."""
+
+    start = 0
+    if total is None:
+        first = fetch(0)
+        yield first
+        start, total = page_size, first['total']
+
+    offsets = range(start, total, page_size)
+    if not offsets:
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque()
+        try:
+            for offset in offsets:
+                pending.append(pool.submit(fetch, offset))
+                if len(pending) >= 2 * max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # consumer stopped early or a request failed
+            for future in pending:
+                future.cancel()
+
+def map_concurrent(fn, items, max_workers: int = MAX_WORKERS):
+    """Apply `fn` to all items concurrently and return the results in order."""
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(fn, items))
+
+def http_status(error: Exception):
+    """Return the HTTP status code of an API client exception, or None."""
+
+    status = getattr(error, 'http_status', None)  # spotipy
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)  # requests
+    return status
+
+def submit_chunks(submit, items: list, chunk_size: int, max_workers: int = MAX_WORKERS):
+    """Submit items in chunks of at most `chunk_size` items concurrently.
+
+    `submit(chunk)` sends one chunk and raises on failure. Chunks rejected
+    because of their content (see ITEM_ERROR_STATUS) are split in halves to
+    isolate the bad items, so one invalid item does not fail the whole
+    submission. Any other error (auth, connection, throttling after the
+    session's retries) aborts the submission, all unsent items then fail.
+    Returns the lists of submitted and failed items."""
+
+    aborted = threading.Event()
+
+    def send(chunk):
+        if aborted.is_set():
+            return [], chunk
+        try:
+            submit(chunk)
+            return chunk, []
+        except Exception as e:
+            if http_status(e) not in ITEM_ERROR_STATUS:
+                if not aborted.is_set():
+                    aborted.set()
+                    print(f"Submission aborted: {e}")
+                return [], chunk
+            error = e
+
+        if len(chunk) == 1:
+            print(f"Failed to submit {chunk[0]!r}: {error}")
+            return [], chunk
+
+        # bisect to find the failing items
+        mid = len(chunk) // 2
+        ok_a, failed_a = send(chunk[:mid])
+        ok_b, failed_b = send(chunk[mid:])
+        return ok_a + ok_b, failed_a + failed_b
+
+    chunks = [ items[i:i + chunk_size] for i in range(0, len(items), chunk_size) ]
+
+    submitted, failed = [], []
+    for ok, bad in map_concurrent(send, chunks, max_workers):
+        submitted.extend(ok)
+        failed.extend(bad)
+    return submitted, failed
+
+def playlist_delta(current: list, desired: list):
+    """Compute the edits that turn the `current` list of track ids into the
+    `desired` one. Returns the positions to remove (in `current`) and a list
+    of (position, ids) insertions. Insertions are sorted by position and must
+    be applied in order after all removals, positions are then valid in the
+    final list. A moved track shows up as a removal plus an insertion.
+
+    `None` entries in `current` (items that can't be referenced by id, like
+    unavailable tracks or local files) are never removed, the insertion
+    positions take the ones left in place into account."""
+
+    removals, insertions = [], []
+    kept = 0  # None entries left in place so far
+    matcher = SequenceMatcher(None, current, desired, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag in ('replace', 'insert'):
+            insertions.append((j1 + kept, desired[j1:j2]))
+        if tag in ('replace', 'delete'):
+            for i in range(i1, i2):
+                if current[i] is None:
+                    kept += 1
+                else:
+                    removals.append(i)
+
+    return removals, insertions
+
+#############################################################################
+
+class PlaylistIndex:
+    """Maps remote playlist ids and names to (remote id, version), so that
+    submitted playlists can be looked up without listing all playlists."""
+
+    def __init__(self, entries=()):
+        self.by_id = {}
+        self.by_name = {}
+        for id, name, version in entries:
+            self.add(id, name, version)
+
+    def add(self, id: str, name: str, version: str = ""):
+        """Add or update a playlist. The first playlist of a given name wins."""
+
+        entry = (id, version)
+        self.by_id[id] = entry
+        if self.by_name.get(name, entry)[0] == id:
+            self.by_name[name] = entry
+
+    def find(self, playlist):
+        """Return (remote id, version) of the playlist, matched by id or else by name."""
+
+        return self.by_id.get(playlist.id) or self.by_name.get(playlist.name)
+
+#############################################################################
+
+class SavedItems:
+    """Remembers the saved items of one kind (e.g. the user's saved tracks)
+    as of the last load, to allow incremental refreshes.
+
+    An incremental refresh reads a newest-first page stream only until it
+    reaches an item known from the last load, and returns the new items
+    followed by the known ones. Items removed in the meantime are only
+    noticed by a full reload, which is done every FULL_RELOAD_INTERVAL
+    seconds."""
+
+    def __init__(self, full_reload_interval: float = FULL_RELOAD_INTERVAL):
+        self.full_reload_interval = full_reload_interval
+        self.items = None  # newest first
+        self.reloaded = 0.0
+
+    def restore(self, items: list, reloaded: float):
+        """Set the items of an earlier load, e.g. from a library snapshot."""
+        self.items, self.reloaded = items, reloaded
+
+    def needsFullReload(self):
+        return self.items is None or time.time() - self.reloaded > self.full_reload_interval
+
+    def load(self, pages, new_pages=None):
+        """Yield pages of items from the `pages` stream and remember them. If a
+        newest-first stream `new_pages` is given and no full reload is due,
+        refresh incrementally from that stream instead."""
+
+        if new_pages is None or self.needsFullReload():
+            items = []
+            for page in pages:
+                items.extend(page)
+                yield page
+            self.items, self.reloaded = items, time.time()
+            return
+
+        known = { item.id for item in self.items }
+        added = []
+        for page in new_pages:
+            new = []
+            for item in page:
+                if item.id in known:
+                    break
+                new.append(item)
+            if new:
+                added.extend(new)
+                yield new
+            if len(new) < len(page):
+                break  # reached the items of the last load
+
+        print(f"Incremental refresh: {len(added)} new items")
+        if self.items:
+            yield self.items
+        self.items = added + self.items
+
+#############################################################################
+
+class PlaylistCache:
+    """On-disk cache of playlist tracks. An entry is only used while the
+    playlist's version (Spotify snapshot id, Tidal last update) is unchanged."""
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.entries = {}  # playlist id -> { 'version': ..., 'tracks': [ track dicts ] }
+        self.modified = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.filename, 'r', encoding='utf8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except json.decoder.JSONDecodeError:
+            return
+
+        if data.get('format') == self.FORMAT_VERSION:
+            self.entries = data.get('playlists', {})
+
+    def save(self):
+        with self.lock:
+            if not self.modified:
+                return
+            data = { 'format': self.FORMAT_VERSION, 'playlists': self.entries }
+            self.modified = False
+
+        # write to a temporary file first, so an interrupted save keeps the old cache
+        print(f"Saving playlist cache {self.filename} ...")
+        with open(self.filename + '.tmp', 'w', encoding='utf8') as f:
+            json.dump(data, f)
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def get(self, playlist):
+        """Return the cached track dicts of the playlist, or None if outdated."""
+
+        entry = self.entries.get(playlist.id)
+        if entry and playlist.version and entry['version'] == playlist.version:
+            return entry['tracks']
+        return None
+
+    def put(self, playlist, tracks: list):
+        if not playlist.version:
+            return  # cannot be validated later
+
+        entry = { 'version': playlist.version, 'tracks': [ track.asDict() for track in tracks ] }
+        with self.lock:
+            self.entries = { **self.entries, playlist.id: entry }  # copy, save() may serialize concurrently
+            self.modified = True
+
+    def prune(self, playlist_ids):
+        """Drop the entries of playlists that no longer exist."""
+
+        playlist_ids = set(playlist_ids)
+        with self.lock:
+            if not self.entries.keys() <= playlist_ids:
+                self.entries = { id: entry for id, entry in self.entries.items() if id in playlist_ids }
+                self.modified = True
+
+#############################################################################
+
+class PlaylistLoader:
+    """Loads playlist tracks on demand and warms the remaining playlists in
+    the background. `fetch_tracks(playlist)` returns the list of tracks."""
+
+    def __init__(self, fetch_tracks, max_workers: int = MAX_WORKERS):
+        self.fetch_tracks = fetch_tracks
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = {}  # playlist id -> future
+        self.lock = threading.RLock()
+
+    def load(self, playlist):
+        """Return the playlist's tracks, loading them now if necessary."""
+
+        if not playlist.isLoaded():
+            with self.lock:
+                future = self.futures.pop(playlist.id, None)
+
+            if future is None or future.cancel():
+                # not requested yet or still queued, don't wait for the prefetcher
+                tracks = self.fetch_tracks(playlist)
+            else:
+                try:
+                    tracks = future.result()
+                except Exception:
+                    tracks = self.fetch_tracks(playlist)  # prefetch failed, try again
+            playlist.setTracks(tracks)
+
+        return playlist.getTracks()
+
+    def prefetch(self, playlists):
+        """Queue loading of all playlists that are not loaded yet."""
+
+        with self.lock:
+            for playlist in playlists:
+                if playlist.isLoaded() or playlist.id in self.futures:
+                    continue
+                future = self.pool.submit(self.fetch_tracks, playlist)
+                future.add_done_callback(lambda f, playlist=playlist: self._done(playlist, f))
+                self.futures[playlist.id] = future
+
+    def _done(self, playlist, future):
+        # don't overwrite tracks that were set (or edited) in the meantime
+        if not future.cancelled() and future.exception() is None and not playlist.isLoaded():
+            playlist.setTracks(future.result())
+        with self.lock:
+            if self.futures.get(playlist.id) is future:
+                del self.futures[playlist.id]
+
+    def cancel(self):
+        """Drop all queued prefetch requests."""
+
+        with self.lock:
+            for future in self.futures.values():
+                future.cancel()
+            self.futures = {}
+
+    def close(self):
+        """Drop all queued requests and stop the workers, without waiting for
+        running requests."""
+
+        with self.lock:
+            self.futures = {}
+        self.pool.shutdown(wait=False, cancel_futures=True)
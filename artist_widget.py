@@ -7,18 +7,14 @@ from item_models import ArtistModel
 #############################################################################
 
 class ArtistWidget(_WidgetTemplate):
+
+    SNAPSHOT_KIND = 'artists'
+
     def __init__(self, parent):
         super().__init__(parent)
 
         # artist data
-        self.wTableModelA = ArtistModel()
-        self.wTableViewA.setModel(self.wTableModelA)
-
-        self.wTableModelB = ArtistModel()
-        self.wTableViewB.setModel(self.wTableModelB)
-
-        self.wTableModelA.setSiblingModel(self.wTableModelB)
-        self.wTableModelB.setSiblingModel(self.wTableModelA)
+        self.setModels(ArtistModel(), ArtistModel())
         
         # layout
         self.wLayout = QHBoxLayout()
@@ -30,23 +26,25 @@ class ArtistWidget(_WidgetTemplate):
 
     def _loadData(self, app, view: QTableView):
 
-        model = view.model()
+        model = self.modelOf(view)
         model.clear()
         
         self.parent.busy()
         print(f"\nLoading artists from {app.name} ...")
-        
-        items = app.get_saved_artists()
-        artists = sorted(items, key=lambda x: x.sortKey())
 
-        print(f"=> Artists ({len(artists)}):")
-        for artist in artists:
+        self._loadPages(app, view, self._iterPages(app))
+
+    def _iterPages(self, app):
+        return app.iter_saved_artists(incremental=True)
+
+    def _loadFinished(self, app, view: QTableView):
+
+        model = self.modelOf(view)
+
+        print(f"=> Artists ({len(model.items)}):")
+        for artist in model.items:
             print(f"Loaded artist: {artist.name}")
-            model.add(artist)
 
-        self.wTableModelA.layoutChanged.emit()
-        self.wTableModelB.layoutChanged.emit()
-        
         self.parent.showMessage(f"\nLoaded {len(model.items)} artists from {app.name} ...")
         self.parent.done()
 
@@ -54,13 +52,15 @@ class ArtistWidget(_WidgetTemplate):
                       appA, viewA: QTableView,
                       appB, viewB: QTableView):
 
-        modelA = viewA.model()
-        modelB = viewB.model()
+        modelA = self.modelOf(viewA)
+        modelB = self.modelOf(viewB)
                 
         self.parent.busy()
 
         num_items = 0
 
+        restored = self._restoreMappings('artist', modelA.items, modelB, appB.get_artists)
+
         for a_artist in modelA.items:
             a_name = a_artist.simplifiedName()
             a_id = a_artist.id
@@ -74,8 +74,9 @@ class ArtistWidget(_WidgetTemplate):
 
             # Re-use known mapping
             b_id = self.parent.mappingTable.find('artist', a_id)
-            if b_id:
-                b_artist = appB.get_artist(b_id)
+            b_artist = restored.get(b_id) if b_id else None
+            if b_artist:
+                b_name = b_artist.simplifiedName()
 
                 print(f"Transfer artist: {a_name} ({appA.name}:{a_id}) => {b_name} ({appB.name}:{b_id}) [restored]")
                 b_artist.setDirty(True)  # mark as dirty to save later
@@ -88,23 +89,18 @@ class ArtistWidget(_WidgetTemplate):
             print("Searching for artist:", query)
             result = appB.search_artist(query)
 
-            # Find matching artist in search results
-            match = False
-            for b_artist in result:
+            # Find best matching artist in search results
+            b_artist, score = self.parent.matcher.bestMatch(a_artist, result)
+            match = b_artist is not None
+            if match:
                 b_name = b_artist.simplifiedName()
+                b_id = str(b_artist.id)
 
-                # Must have exact, case-insensitive match
-                if b_artist.name.lower() == a_artist.name.lower():
-                    b_id = str(b_artist.id)
-
-                    print(f"Transfer artist: {a_name} ({appA.name}:{a_id}) => {b_name} ({appB.name}:{b_id}) [matched]")
-                    b_artist.setDirty(True)  # mark as dirty to save later
-                    modelB.insert(b_artist)
-                    num_items += 1
-                    self.parent.mappingTable.add('artist', a_id, b_id)
-
-                    match = True
-                    break
+                print(f"Transfer artist: {a_name} ({appA.name}:{a_id}) => {b_name} ({appB.name}:{b_id}) [matched {score:.2f}]")
+                b_artist.setDirty(True)  # mark as dirty to save later
+                modelB.insert(b_artist)
+                num_items += 1
+                self.parent.mappingTable.add('artist', a_id, b_id)
 
             if not match:
                 # Allow to manually specify an artist id
@@ -135,15 +131,12 @@ class ArtistWidget(_WidgetTemplate):
                 else:
                     return
 
-        self.wTableModelA.layoutChanged.emit()
-        self.wTableModelB.layoutChanged.emit()
-
         self.parent.showMessage(f"\nTransferred {num_items} artists to {appB.name} ...")
         self.parent.done()
 
     def _submitData(self, app, view: QTableView):
 
-        model = view.model()
+        model = self.modelOf(view)
 
         added_artists = []
         for item in model.items:
@@ -158,13 +151,21 @@ class ArtistWidget(_WidgetTemplate):
 
         #print(added_artists)
         print(f"Adding {len(added_artists)} artists to {app.name} ...")
-        app.add_saved_artists(added_artists)
-
-        dlg = MessageDialog(self, "Success!",
-            f"{len(added_artists)} artist(s) were added to {app.name}.")
+        submitted, failed = app.add_saved_artists(added_artists)
+
+        # only confirmed artists are saved, failed ones stay dirty for the next submit
+        for artist in submitted:
+            artist.setDirty(False)
+        model.updateStatus([ artist.simplifiedName() for artist in submitted ])
+
+        if failed:
+            dlg = MessageDialog(self, "Warning!",
+                f"{len(submitted)} artist(s) were added to {app.name}, {len(failed)} artist(s) failed.")
+        else:
+            dlg = MessageDialog(self, "Success!",
+                f"{len(submitted)} artist(s) were added to {app.name}.")
         dlg.exec()
-        
-        self._loadData(app, view)
-        
-        self.parent.showMessage(f"\nSubmitted {len(added_artists)} artists to {app.name} ...")
+
+        self.parent.showMessage(f"\nSubmitted {len(submitted)} artists to {app.name} ...")
+
         self.parent.done()
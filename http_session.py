@@ -0,0 +1,172 @@
+import random
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app_utils import MAX_WORKERS
+
+#############################################################################
+
+DEFAULT_TIMEOUT = (5, 20)  # (connect, read) in seconds
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 0.5  # seconds, doubled on every retry
+POOL_SIZE = MAX_WORKERS * (MAX_WORKERS + 1)  # playlist prefetch workers run their own page fetchers
+BACKOFF_INTERVAL = 1.0  # seconds, the limiter backs off at most once per interval
+
+#############################################################################
+
+class BackoffRetry(Retry):
+    """Retry policy with jittered exponential backoff.
+
+    Server errors are only retried for idempotent requests, but rate limited
+    (429) requests were not processed and are retried for any method. A
+    Retry-After header takes precedence over the backoff time."""
+
+    RETRY_STATUS = frozenset([ 429, 500, 502, 503, 504 ])
+
+    def __init__(self, total=MAX_RETRIES, **kwargs):
+        kwargs.setdefault('backoff_factor', BACKOFF_FACTOR)
+        kwargs.setdefault('status_forcelist', self.RETRY_STATUS)
+        kwargs.setdefault('respect_retry_after_header', True)
+        kwargs.setdefault('raise_on_status', False)  # let the API clients handle the final response
+        super().__init__(total=total, **kwargs)
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == 429:
+            return bool(self.total)
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_backoff_time(self):
+        # spread concurrent retries so they don't hit the API at the same time
+        return super().get_backoff_time() * random.uniform(0.5, 1.5)
+
+class RateLimiter:
+    """Token bucket limiting the request rate, combined with an AIMD
+    controller for the rate and the number of concurrent requests.
+
+    Every healthy response increases the concurrency by about one per round
+    trip and the rate by about `rate_step` per second, a throttled or failed
+    one (429/5xx, also if it succeeded after a retry) halves both. The
+    current `rate` and `concurrency` limits and the number of requests
+    `in_flight` can be read at any time. The providers size the worker pools
+    of new fetches from `concurrency`, so a raised limit applies to the next
+    fetch."""
+
+    def __init__(self, rate: float, max_rate: float, rate_step: float = 1.0,
+                 concurrency: int = MAX_WORKERS, max_concurrency: int = POOL_SIZE):
+        self.rate = rate  # requests per second
+        self.min_rate = min(1.0, rate)
+        self.max_rate = max_rate
+        self.rate_step = rate_step
+        self.concurrency = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.backed_off = 0.0
+        self.cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        burst = max(1.0, self.concurrency)
+        self.tokens = min(burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a request may be sent."""
+
+        with self.cond:
+            while True:
+                self._refill()
+                if self.in_flight < int(self.concurrency) and self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    self.in_flight += 1
+                    return
+
+                # wait for the next token (or for a running request to finish)
+                self.cond.wait((1.0 - self.tokens) / self.rate if self.tokens < 1.0 else None)
+
+    def release(self, congested: bool = False):
+        """Report a finished request and adapt the limits."""
+
+        with self.cond:
+            self.in_flight -= 1
+
+            if congested:
+                now = time.monotonic()
+                if now - self.backed_off > BACKOFF_INTERVAL:
+                    self.backed_off = now
+                    self.concurrency = max(1.0, self.concurrency / 2)
+                    self.rate = max(self.min_rate, self.rate / 2)
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                self.rate = min(self.max_rate, self.rate + self.rate_step / self.rate)
+
+            self.cond.notify_all()
+
+class HttpSession(requests.Session):
+    """Keep-alive session with a connection pool sized for our concurrency,
+    retries with backoff, and per-endpoint timeouts.
+
+    `timeouts` maps URL path patterns to (connect, read) timeouts, the first
+    matching pattern wins. Requests made without an explicit timeout get the
+    matching or default timeout. If a `limiter` is given, all requests
+    pass through it."""
+
+    def __init__(self, timeouts: dict = None, default_timeout=DEFAULT_TIMEOUT,
+                 max_retries: int = MAX_RETRIES, pool_size: int = POOL_SIZE,
+                 limiter: RateLimiter = None):
+        super().__init__()
+
+        self.limiter = limiter
+        self.local = threading.local()  # last response per thread, see lastResponse()
+
+        self.timeouts = [ (re.compile(pattern), timeout) for pattern, timeout in (timeouts or {}).items() ]
+        self.default_timeout = default_timeout
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=BackoffRetry(max_retries))
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def timeoutFor(self, url: str):
+        for pattern, timeout in self.timeouts:
+            if pattern.search(url):
+                return timeout
+        return self.default_timeout
+
+    @staticmethod
+    def isCongested(response: requests.Response):
+        """Return True if the response (or one of its retries) was throttled or failed."""
+
+        retries = getattr(response.raw, 'retries', None)
+        history = retries.history if retries else ()
+        return (response.status_code in BackoffRetry.RETRY_STATUS
+                or any(h.status in BackoffRetry.RETRY_STATUS for h in history))
+
+    def lastResponse(self):
+        """Return the last response received by the calling thread, for API
+        clients that only report success or failure."""
+
+        return getattr(self.local, 'response', None)
+
+    def request(self, method, url, *args, **kwargs):
+        if len(args) < 7 and kwargs.get('timeout') is None:  # timeout not given (positionally or by keyword)
+            kwargs['timeout'] = self.timeoutFor(url)
+
+        if self.limiter is None:
+            response = self.local.response = super().request(method, url, *args, **kwargs)
+            return response
+
+        self.limiter.acquire()
+        congested = True  # also back off on timeouts and connection errors
+        try:
+            response = self.local.response = super().request(method, url, *args, **kwargs)
+            congested = self.isCongested(response)
+            return response
+        finally:
+            self.limiter.release(congested)
@@ -0,0 +1,92 @@
+import re
+from difflib import SequenceMatcher
+
+from item_types import _TypeTemplate, Artist, Album, Track, simplifiedName
+
+#############################################################################
+
+# numbers and roman numerals (up to 39), e.g. "part 2", "vol 1", "led zeppelin iii"
+_NUMBER_PATTERN = re.compile(r'^(\d+|x{0,3}(ix|iv|v?i{0,3}))$')
+
+#############################################################################
+
+class ItemMatcher:
+    """Scores search results against an item and picks the best candidate.
+
+    Each field is compared on its simplified form, using the better of a
+    token-set (Dice) similarity and, for longer titles, a character-level
+    similarity, and the field scores are combined with per-type weights.
+    Fields with different numbers (part 1 / part 2, vol ii / vol iii) never
+    match. Tracks whose durations differ by more than DURATION_TOLERANCE
+    seconds are penalized."""
+
+    ACCEPT_THRESHOLD = 0.85     # minimum score to accept a candidate automatically
+    DURATION_TOLERANCE = 5      # seconds
+    DURATION_PENALTY = 0.5      # score factor for tracks with a different duration
+    FUZZY_MIN_LENGTH = 12       # minimum length of both names for a character-level comparison
+
+    FIELD_WEIGHTS = {  # (field, weight, compare character-level)
+        Artist: [ ('_name', 1.0, False) ],
+        Album:  [ ('artist', 0.4, False), ('_name', 0.6, True) ],
+        Track:  [ ('artist', 0.3, False), ('album', 0.2, True), ('_name', 0.5, True) ],
+    }
+
+    def __init__(self, accept_threshold: float = ACCEPT_THRESHOLD,
+                 duration_tolerance: int = DURATION_TOLERANCE):
+        self.accept_threshold = accept_threshold
+        self.duration_tolerance = duration_tolerance
+
+    @classmethod
+    def similarity(cls, a: str, b: str, fuzzy: bool = True):
+        """Return a similarity between 0 and 1 of two (raw) field values. The
+        character-level similarity is only used if `fuzzy` is set."""
+
+        a, b = simplifiedName(a), simplifiedName(b)
+        if a == b:
+            return 1.0
+        if not a or not b:
+            return 0.0
+
+        tokens_a, tokens_b = set(a.split()), set(b.split())
+        if cls._numbers(tokens_a) != cls._numbers(tokens_b):
+            return 0.0  # e.g. another part or volume
+
+        dice = 2 * len(tokens_a & tokens_b) / (len(tokens_a) + len(tokens_b))
+        if dice == 1.0 or not fuzzy or min(len(a), len(b)) < cls.FUZZY_MIN_LENGTH:
+            return dice
+
+        return max(dice, SequenceMatcher(None, a, b).ratio())
+
+    @staticmethod
+    def _numbers(tokens: set):
+        return { token for token in tokens if _NUMBER_PATTERN.match(token) }
+
+    def score(self, a: _TypeTemplate, b: _TypeTemplate):
+        """Return a match score between 0 and 1 of two items of the same type."""
+
+        weights = self.FIELD_WEIGHTS.get(type(a), [ ('_name', 1.0, False) ])
+        score = sum(weight * self.similarity(getattr(a, field), getattr(b, field), fuzzy)
+                    for field, weight, fuzzy in weights)
+
+        duration_a = getattr(a, 'duration', None)
+        duration_b = getattr(b, 'duration', None)
+        if duration_a and duration_b and abs(duration_a - duration_b) > self.duration_tolerance:
+            score *= self.DURATION_PENALTY
+
+        return score
+
+    def bestMatch(self, item: _TypeTemplate, candidates: list):
+        """Return the best scoring candidate and its score. The candidate is
+        None if no score reaches the acceptance threshold."""
+
+        best, best_score = None, 0.0
+        for candidate in candidates:
+            score = self.score(item, candidate)
+            if score > best_score:
+                best, best_score = candidate, score
+                if score == 1.0:
+                    break
+
+        if best_score < self.accept_threshold:
+            return None, best_score
+        return best, best_score
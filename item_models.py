@@ -1,8 +1,8 @@
 from enum import Enum
-from PyQt6.QtCore import Qt, QAbstractTableModel
+from PyQt6.QtCore import Qt, QAbstractTableModel, QSortFilterProxyModel, QModelIndex
 from PyQt6.QtGui import QColor
 
-from item_types import _TypeTemplate
+from item_types import _TypeTemplate, simplifiedName
 
 #############################################################################
 
@@ -20,6 +20,8 @@ class MyColors(Enum):
 class _ModelTemplate(QAbstractTableModel):
 
     COLUMNS = []
+    SORT_KEYS = []   # columns compared when sorting by the respective column
+    DEFAULT_SORT_COLUMN = 1
     STATUS_INDICATORS = [ '+', 'o', 'x' ]  # modified/matching/not matching
     STATUS_COLORS =  [ MyColors.Yellow.value, MyColors.Green.value, MyColors.Orange.value ]
 
@@ -28,6 +30,11 @@ class _ModelTemplate(QAbstractTableModel):
         self.items = []
         self.names = []
         self.ids   = []
+        self.nameIndex = {}  # simplified name -> list of positions (names may repeat)
+        self.idIndex   = {}  # id -> position
+        self.offset    = 0   # row = position - offset, so prepending does not shift the index
+        self.status    = []  # cached row status, see getRowStatus()
+        self.sortKeys  = [ [] for _ in self.COLUMNS[:-1] ]  # cached sort values per column, see sortValues()
         self.siblingModel = None
 
     def setSiblingModel(self, model: "_ModelTemplate"):
@@ -38,61 +45,235 @@ class _ModelTemplate(QAbstractTableModel):
             return self.COLUMNS[section]
         return super().headerData(section, orientation, role)
 
-    def getRowStatus(self, row):
-        if self.items[row].dirty:
+    def _computeStatus(self, item: _TypeTemplate, name: str):
+        if item.dirty:
             return 0  # modified
-        elif self.names[row] in self.siblingModel.names:
+        elif self.siblingModel and name in self.siblingModel.nameIndex:
             return 1  # matching
         else:
             return 2  # not matching
 
+    def getRowStatus(self, row):
+        return self.status[row]
+
+    def updateStatus(self, names=None):
+        """Recompute the status of all rows with the given names (or all rows),
+        and notify views about the rows that actually changed."""
+
+        if names is None:
+            rows = range(len(self.items))
+        else:
+            rows = [ pos - self.offset for name in set(names)
+                     for pos in self.nameIndex.get(name, []) ]
+
+        changed = []
+        for row in rows:
+            status = self._computeStatus(self.items[row], self.names[row])
+            if status != self.status[row]:
+                self.status[row] = status
+                changed.append(row)
+
+        self._emitRowsChanged(changed)
+
+    def _emitRowsChanged(self, rows):
+        # emit one signal per contiguous block of rows
+        rows = sorted(rows)
+        last_column = len(self.COLUMNS) - 1
+        start = 0
+        for i in range(1, len(rows) + 1):
+            if i == len(rows) or rows[i] != rows[i-1] + 1:
+                self.dataChanged.emit(self.index(rows[start], 0), self.index(rows[i-1], last_column))
+                start = i
+
+    def _updateSibling(self, names):
+        if self.siblingModel:
+            self.siblingModel.updateStatus(names)
+
     def rowCount(self, index):
         return len(self.items)
 
     def columnCount(self, index):
         return len(self.COLUMNS)
         
+    def sortValues(self, item: _TypeTemplate):
+        """Return normalized sort values of an item, one per column (status excluded)."""
+        return ()
+
+    def sortColumn(self, column):
+        if column == len(self.COLUMNS) - 1:
+            return self.status
+        return self.sortKeys[column]
+
     def sort(self, column, order):
+        if not self.SORT_KEYS or column < 0:
+            return
+
         self.layoutAboutToBeChanged.emit()
-        
-        # sort via DSU approach
-        decorated = self.sortKey(column)
-        decorated.sort()
-        if order == Qt.SortOrder.DescendingOrder:
-            decorated.reverse()
-
-        self.items = [item for key, i, item in decorated]
-        self.update()
+
+        # stable multi-pass argsort, least significant column first
+        reverse = (order == Qt.SortOrder.DescendingOrder)
+        perm = list(range(len(self.items)))
+        for key_column in reversed(self.SORT_KEYS[column]):
+            perm.sort(key=self.sortColumn(key_column).__getitem__, reverse=reverse)
+
+        self._permute(perm)
         self.layoutChanged.emit()
+
+    def _permute(self, perm):
+        self.items  = [ self.items[i]  for i in perm ]
+        self.names  = [ self.names[i]  for i in perm ]
+        self.ids    = [ self.ids[i]    for i in perm ]
+        self.status = [ self.status[i] for i in perm ]
+        self.sortKeys = [ [ values[i] for i in perm ] for values in self.sortKeys ]
+        self._rebuildIndex()
+
+    def _rebuildIndex(self):
+        self.offset = 0
+        self.nameIndex = {}
+        for row, name in enumerate(self.names):
+            self.nameIndex.setdefault(name, []).append(row)
+        self.idIndex = { id: row for row, id in reversed(list(enumerate(self.ids))) }
         
     def clear(self):
+        names = list(self.nameIndex)
+
+        self.beginResetModel()
         self.items = []
         self.names = []
         self.ids   = []
+        self.nameIndex = {}
+        self.idIndex   = {}
+        self.offset    = 0
+        self.status    = []
+        self.sortKeys  = [ [] for _ in self.COLUMNS[:-1] ]
+        self.endResetModel()
+
+        self._updateSibling(names)
         
-    def update(self):
-        self.names = [ x.simplifiedName().lower() for x in self.items ]
-        self.ids = [ x.id for x in self.items ]
+    def _append(self, item: _TypeTemplate):
+        name = item.simplifiedName()
+        pos = len(self.items) + self.offset
 
-    def add(self, item: _TypeTemplate):
         self.items.append(item)
-        self.update()
+        self.names.append(name)
+        self.ids.append(item.id)
+        self.nameIndex.setdefault(name, []).append(pos)
+        self.idIndex.setdefault(item.id, pos)
+        self.status.append(self._computeStatus(item, name))
+        for values, value in zip(self.sortKeys, self.sortValues(item)):
+            values.append(value)
+        return name
+
+    def _prepend(self, item: _TypeTemplate):
+        name = item.simplifiedName()
+        self.offset -= 1
+        pos = self.offset
 
-    def insert(self, item: _TypeTemplate):
         self.items.insert(0, item)
-        self.update()
+        self.names.insert(0, name)
+        self.ids.insert(0, item.id)
+        self.nameIndex.setdefault(name, []).insert(0, pos)
+        self.idIndex[item.id] = pos
+        self.status.insert(0, self._computeStatus(item, name))
+        for values, value in zip(self.sortKeys, self.sortValues(item)):
+            values.insert(0, value)
+        return name
+
+    def add(self, item: _TypeTemplate):
+        row = len(self.items)
+        self.beginInsertRows(QModelIndex(), row, row)
+        name = self._append(item)
+        self.endInsertRows()
+
+        self._updateSibling([name])
+
+    def extend(self, items: list[_TypeTemplate]):
+        if not items:
+            return
+        row = len(self.items)
+        self.beginInsertRows(QModelIndex(), row, row + len(items) - 1)
+        names = [ self._append(item) for item in items ]
+        self.endInsertRows()
+
+        self._updateSibling(names)
+
+    def insert(self, item: _TypeTemplate):
+        self.beginInsertRows(QModelIndex(), 0, 0)
+        name = self._prepend(item)
+        self.endInsertRows()
+
+        self._updateSibling([name])
+
+    def syncKey(self, item: _TypeTemplate):
+        """Identity of an item when syncing, see sync()."""
+        return item.id
+
+    def sync(self, items: list[_TypeTemplate]):
+        """Update the model to show the given items, only removing and adding
+        the rows that differ. Modified (dirty) rows are kept."""
+
+        keys = set(map(self.syncKey, items))
+        current = set(map(self.syncKey, self.items))
+
+        self.removeItemRows([ row for row, item in enumerate(self.items)
+                          if not item.dirty and self.syncKey(item) not in keys ])
+        self.extend([ item for item in items if self.syncKey(item) not in current ])
+
+    def removeItemRows(self, rows: list[int]):
+        if not rows:
+            return
+        rows = sorted(rows)
+        names = [ self.names[row] for row in rows ]
+
+        # contiguous blocks of rows, removed bottom-up so row numbers stay valid
+        blocks = []
+        for row in rows:
+            if blocks and blocks[-1][1] == row - 1:
+                blocks[-1][1] = row
+            else:
+                blocks.append([row, row])
+
+        columns = [ self.items, self.names, self.ids, self.status, *self.sortKeys ]
+        for first, last in reversed(blocks):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            for values in columns:
+                del values[first:last + 1]
+            self.endRemoveRows()
+        self._rebuildIndex()
+
+        self._updateSibling(names)
+
+    def findRow(self, name: str):
+        """Return the first row with the given simplified name."""
+        pos = self.nameIndex.get(name)
+        if not pos:
+            return None
+        return pos[0] - self.offset
+
+    def findRowById(self, id: str):
+        pos = self.idIndex.get(str(id))
+        if pos is None:
+            return None
+        return pos - self.offset
 
     def find(self, name: str):
-        if name.lower() not in self.names:
+        row = self.findRow(name)
+        if row is None:
+            return None
+        return self.items[row]
+
+    def findById(self, id: str):
+        row = self.findRowById(id)
+        if row is None:
             return None
-        index = self.names.index(name.lower())
-        return self.items[index]
+        return self.items[row]
 
 #############################################################################
 
 class ArtistModel(_ModelTemplate):
 
     COLUMNS = ['id', 'name', 'status']
+    SORT_KEYS = [ (0,), (1, 0), (2, 1, 0) ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -109,22 +290,16 @@ class ArtistModel(_ModelTemplate):
         elif role == Qt.ItemDataRole.BackgroundRole:
             return self.STATUS_COLORS[self.getRowStatus(index.row())]
 
-    def sortKey(self, column):
-        if column == 0:
-            return [ ((item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 1:
-            return [ ((item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 2:
-            return [ ((self.getRowStatus(row), item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
+    def sortValues(self, item):
+        return (item.id, item._name.lower())
 
 #############################################################################
 
 class AlbumModel(_ModelTemplate):
 
     COLUMNS = ['id', 'name', 'artist', 'status']
+    SORT_KEYS = [ (0,), (1, 0), (2, 1, 0), (3, 2, 1, 0) ]
+    DEFAULT_SORT_COLUMN = 2
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -143,25 +318,16 @@ class AlbumModel(_ModelTemplate):
         elif role == Qt.ItemDataRole.BackgroundRole:
             return self.STATUS_COLORS[self.getRowStatus(index.row())]
 
-    def sortKey(self, column):
-        if column == 0:
-            return [ ((item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 1:
-            return [ ((item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 2:
-            return [ ((item.artist, item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 3:
-            return [ ((self.getRowStatus(row), item.artist, item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
+    def sortValues(self, item):
+        return (item.id, item._name.lower(), item.artist.lower())
 
 #############################################################################
 
 class TrackModel(_ModelTemplate):
 
     COLUMNS = ['id', 'name', 'artist', 'album', 'status']
+    SORT_KEYS = [ (0,), (1, 0), (2, 1, 0), (3, 2, 1, 0), (4, 3, 2, 1, 0) ]
+    DEFAULT_SORT_COLUMN = 2
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -182,28 +348,15 @@ class TrackModel(_ModelTemplate):
         elif role == Qt.ItemDataRole.BackgroundRole:
             return self.STATUS_COLORS[self.getRowStatus(index.row())]
 
-    def sortKey(self, column):
-        if column == 0:
-            return [ ((item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 1:
-            return [ ((item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 2:
-            return [ ((item.artist, item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 3:
-            return [ ((item.album, item.artist, item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 4:
-            return [ ((self.getRowStatus(row), item.album, item.artist, item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
+    def sortValues(self, item):
+        return (item.id, item._name.lower(), item.artist.lower(), item.album.lower())
 
 #############################################################################
 
 class PlaylistModel(_ModelTemplate):
 
     COLUMNS = ['id', 'name', 'description', 'public', 'num_tracks', 'status']
+    SORT_KEYS = [ (0,), (1, 0), (2, 1, 0), (3, 1, 0), (4, 1, 0), (5, 1, 0) ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -226,22 +379,64 @@ class PlaylistModel(_ModelTemplate):
         elif role == Qt.ItemDataRole.BackgroundRole:
             return self.STATUS_COLORS[self.getRowStatus(index.row())]
 
-    def sortKey(self, column):
-        if column == 0:
-            return [ ((item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 1:
-            return [ ((item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 2:
-            return [ ((item.description, item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 3:
-            return [ ((item.public, item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 4:
-            return [ ((item.num_tracks, item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
-        elif column == 5:
-            return [ ((self.getRowStatus(row), item._name, item.id), row, item)
-                     for row, item in enumerate(self.items) ]
+    def sortValues(self, item):
+        return (item.id, item._name.lower(), item.description.lower(), item.public, None)  # see sortColumn()
+
+    def sortColumn(self, column):
+        if column == 4:
+            # track count changes when tracks are transferred, so it is not cached
+            return [ item.numTracks() for item in self.items ]
+        return super().sortColumn(column)
+
+    def syncKey(self, item):
+        # a modified playlist is replaced, its contents may have changed
+        return (item.id, item.version)
+
+#############################################################################
+
+class ItemFilterProxyModel(QSortFilterProxyModel):
+    """Filters rows of an item model by the words typed into a filter field.
+
+    Matching runs against the source model's simplified names (which include
+    artist and album), and results are cached per distinct name, so typing
+    further characters only re-checks names that matched before."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.filterText = ""
+        self.tokens = []
+        self.matches = {}  # simplified name -> bool
+
+    def setFilterText(self, text: str):
+        text = simplifiedName(text)
+        refine = self.filterText and text.startswith(self.filterText)
+
+        self.filterText = text
+        self.tokens = text.split()
+        if not self.tokens:
+            self.matches = {}
+        elif refine:
+            # narrower query, only names that matched before can match again
+            # (keep the others cached as non-matches)
+            self.matches = { name: match and self._match(name) for name, match in self.matches.items() }
+        else:
+            self.matches = { name: self._match(name) for name in self.sourceModel().nameIndex }
+        self.invalidateFilter()
+
+    def _match(self, name: str):
+        return all(token in name for token in self.tokens)
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if not self.tokens:
+            return True
+
+        name = self.sourceModel().names[source_row]
+        match = self.matches.get(name)
+        if match is None:
+            # row added after the filter was set
+            match = self.matches[name] = self._match(name)
+        return match
+
+    def sort(self, column, order):
+        # let the source model apply its cached sort keys
+        self.sourceModel().sort(column, order)
@@ -1,18 +1,72 @@
 
+import re
+import sys
+import unicodedata
+import weakref
+from functools import lru_cache
+
 #############################################################################
 
+# Version/edition markers that are stripped from names when they appear
+# in brackets or after a dash, e.g. "Song - 2011 Remaster", "Album (Deluxe)"
+STRIP_SUFFIXES = [
+    'remaster', 'remastered', 'deluxe', 'edition', 'expanded', 'anniversary',
+    'bonus track', 'bonus tracks', 'single version', 'album version',
+    'radio edit', 'mono', 'stereo',
+]
+
+# punctuation is removed (quotes) or replaced by whitespace (anything else)
+_TRANSLATE_TABLE = str.maketrans({
+    **{ c: None for c in "'`´’‘\"“”" },
+    **{ c: ' ' for c in "()[]{}-–—:;.,!?/\\|+*_~#" },
+    '&': ' and ',
+})
+
+_FEAT_PATTERN = re.compile(
+    r"\s*[\(\[]\s*(feat|ft|featuring|with)\b[^\)\]]*[\)\]]"  # "(feat. X)", "[with X]"
+    r"|\s+(feat|ft|featuring)\b.*$")                          # "Song feat. X"
+
+def _suffixPattern(words):
+    alternatives = '|'.join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+    return re.compile(
+        rf"\s*[\(\[][^\)\]]*\b({alternatives})\b[^\)\]]*[\)\]]"  # "(2011 Remaster)"
+        rf"|\s+[-–—]\s+[^-–—]*\b({alternatives})\b.*$")            # " - Remastered 2011"
+
+_SUFFIX_PATTERN = _suffixPattern(STRIP_SUFFIXES)
+
+def setStripSuffixes(words: list[str]):
+    """Configure the version/edition markers stripped by simplifiedName()."""
+    global _SUFFIX_PATTERN
+    STRIP_SUFFIXES[:] = [ w.casefold() for w in words ]
+    _SUFFIX_PATTERN = _suffixPattern(STRIP_SUFFIXES)
+    simplifiedName.cache_clear()
+
+@lru_cache(maxsize=1 << 16)
 def simplifiedName(text: str):
-    for c in "()[]{}-:;.,":
-        text = text.replace(c, '')
-    return text.strip()
+    """Normalize a name for matching: case- and accent-insensitive, without
+    featuring credits, edition suffixes, punctuation and repeated whitespace."""
+
+    # fold accents and case
+    text = unicodedata.normalize('NFKD', text)
+    if not text.isascii():
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = text.casefold()
+
+    text = _FEAT_PATTERN.sub('', text)
+    text = _SUFFIX_PATTERN.sub('', text)
+    text = text.translate(_TRANSLATE_TABLE)
+    return ' '.join(text.split())
 
 #############################################################################
 
 class _TypeTemplate:
+    __slots__ = ('_id', '_name', '_dirty', '_simplified', '__weakref__')
+
     def __init__(self, id: str, name: str):
         self._id = id
         self._name = name.strip()
         self._dirty = False
+        self._simplified = None
 
     @property
     def dirty(self):
@@ -29,27 +83,43 @@ class _TypeTemplate:
     def name(self):
         return self._name
 
+    def nameFields(self):
+        return (self._name,)
+
     def simplifiedName(self):
-        return simplifiedName(self.name)
+        # normalize each field separately (and only once per item)
+        if self._simplified is None:
+            self._simplified = ' '.join(filter(None, map(simplifiedName, self.nameFields())))
+        return self._simplified
+
+    def asDict(self):
+        """Return the item's data as a JSON-serializable dict (see fromDict())."""
+        return { 'id': self._id, 'name': self._name }
+
+    @classmethod
+    def fromDict(cls, data: dict):
+        return cls(**data)
 
 #############################################################################
 
 class Artist(_TypeTemplate):
+    __slots__ = ()
+
     def __init__(self, id: str, name: str):
         super().__init__(id, name)
 
     def __repr__(self):
         return f"Artist(id={self.id}, name={self._name})"
 
-    def sortKey(self):
-        return (self._name.lower(),)
-
 #############################################################################
 
 class Album(_TypeTemplate):
-    def __init__(self, id: str, name: str, artist: str):
+    __slots__ = ('artist', 'upc')
+
+    def __init__(self, id: str, name: str, artist: str, upc: str = None):
         super().__init__(id, name)
-        self.artist = artist.strip()
+        self.artist = sys.intern(artist.strip())
+        self.upc = upc or None
 
     def __repr__(self):
         return f"Album(id={self.id}, name={self._name}, artist={self.artist})"
@@ -58,16 +128,23 @@ class Album(_TypeTemplate):
     def name(self):
         return f"{self.artist} - {self._name}"
 
-    def sortKey(self):
-        return (self.artist.lower(), self._name.lower(),)
+    def nameFields(self):
+        return (self.artist, self._name)
+
+    def asDict(self):
+        return { **super().asDict(), 'artist': self.artist, 'upc': self.upc }
 
 #############################################################################
 
 class Track(_TypeTemplate):
-    def __init__(self, id: str, name: str, artist: str, album: str):
+    __slots__ = ('artist', 'album', 'duration', 'isrc')
+
+    def __init__(self, id: str, name: str, artist: str, album: str, duration: int = None, isrc: str = None):
         super().__init__(id, name)
-        self.artist = artist.strip()
-        self.album = album.strip()
+        self.artist = sys.intern(artist.strip())
+        self.album = sys.intern(album.strip())
+        self.duration = duration  # seconds
+        self.isrc = isrc or None
 
     def __repr__(self):
         return f"Track(id={self.id}, name={self._name}, artist={self.artist}, album={self.album})"
@@ -76,37 +153,68 @@ class Track(_TypeTemplate):
     def name(self):
         return f"{self.artist} - {self.album} - {self._name}"
 
-    def sortKey(self):
-        return (self.artist.lower(), self.album.lower(), self._name.lower())
+    def nameFields(self):
+        return (self.artist, self.album, self._name)
+
+    def asDict(self):
+        return { **super().asDict(), 'artist': self.artist, 'album': self.album,
+                 'duration': self.duration, 'isrc': self.isrc }
 
 #############################################################################
 
 class Playlist(_TypeTemplate):
-    def __init__(self, id: str, name: str, descr: str, tracks: list, public: bool = False, image_url: str = ""):
+    __slots__ = ('description', 'public', 'image_url', 'version', '_tracks', '_num_tracks')
+
+    def __init__(self, id: str, name: str, descr: str, tracks: list = None, public: bool = False, image_url: str = "",
+                 num_tracks: int = 0, version: str = ""):
         super().__init__(id, name)
-        self.description = descr.strip()
+        self.description = (descr or "").strip()
         self.public = public
         self.image_url = image_url
-        self._tracks = tracks
+        self.version = version  # changes whenever the playlist is modified
+        self._tracks = tracks  # None if not loaded yet
+        self._num_tracks = num_tracks
 
     def __repr__(self):
         return f"Playlist(id={self.id}, name={self._name}, tracks={self._tracks!r})"
 
-    def sortKey(self):
-        return (self._name.lower(),)
+    def asDict(self):
+        data = { **super().asDict(), 'descr': self.description, 'public': self.public,
+                 'image_url': self.image_url, 'num_tracks': self.numTracks(), 'version': self.version }
+        if self.isLoaded():
+            data['tracks'] = [ track.asDict() for track in self._tracks ]
+        return data
+
+    @classmethod
+    def fromDict(cls, data: dict):
+        data = dict(data)
+        if 'tracks' in data:
+            data['tracks'] = [ Track.fromDict(track) for track in data['tracks'] ]
+        return cls(**data)
+
+    def isLoaded(self):
+        return self._tracks is not None
+
+    def setTracks(self, tracks: list):
+        self._tracks = tracks
 
     def clearTracks(self):
         self._tracks = []
 
     def getTracks(self, chunk_size=0):
+        tracks = self._tracks or []
         if chunk_size > 0:
-            return self.__chunks(self._tracks, chunk_size)
-        return self._tracks
+            return self.__chunks(tracks, chunk_size)
+        return tracks
 
     def addTrack(self, track: Track):
+        if self._tracks is None:
+            self._tracks = []
         self._tracks.append(track)
 
     def numTracks(self):
+        if self._tracks is None:
+            return self._num_tracks  # as reported by the provider
         return len(self._tracks)
 
     @staticmethod
@@ -114,3 +222,29 @@ class Playlist(_TypeTemplate):
         """Yield successive n-sized chunks from lst."""
         for i in range(0, len(lst), n):
             yield lst[i:i + n]
+
+#############################################################################
+
+class ItemRegistry:
+    """Flyweight registry that hands out one shared object per provider id,
+    e.g. for a track that appears in several playlists. Objects are only
+    referenced weakly, so reloaded data does not pile up here."""
+
+    def __init__(self):
+        self._items = {}  # class -> { id: item }
+
+    def get(self, cls, id, *args, **kwargs):
+        if id is None:
+            return cls(id, *args, **kwargs)  # e.g. local files, cannot be shared
+
+        items = self._items.get(cls)
+        if items is None:
+            items = self._items[cls] = weakref.WeakValueDictionary()
+
+        item = items.get(id)
+        if item is None:
+            item = items[id] = cls(id, *args, **kwargs)
+        return item
+
+    def clear(self):
+        self._items.clear()
@@ -0,0 +1,66 @@
+import gzip
+import json
+import os
+import time
+
+from item_types import Artist, Album, Track, Playlist
+
+#############################################################################
+
+class LibrarySnapshot:
+    """Compressed on-disk copy of an account's library (saved artists, albums,
+    tracks and the playlist listing), shown at startup before the data has
+    been revalidated. There is one file per provider account."""
+
+    FORMAT_VERSION = 1
+    KINDS = {
+        'artists':   Artist,
+        'albums':    Album,
+        'tracks':    Track,
+        'playlists': Playlist,
+    }
+
+    def __init__(self, provider: str, account: str):
+        self.filename = f"{provider.lower()}-library-{account}.json.gz"
+
+    def load(self):
+        """Return a dict of kind -> (items, time of last full reload), or None."""
+
+        try:
+            with gzip.open(self.filename, 'rt', encoding='utf8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, EOFError, OSError, json.decoder.JSONDecodeError):
+            return None
+
+        if data.get('format') != self.FORMAT_VERSION:
+            return None
+
+        print(f"Loaded library snapshot {self.filename} from {time.ctime(data['saved'])}")
+        return { kind: ([ self.KINDS[kind].fromDict(item) for item in entry['items'] ], entry['reloaded'])
+                for kind, entry in data['library'].items() if kind in self.KINDS }
+
+    def save(self, library: dict):
+        """Store a dict of kind -> (items, time of last full reload)."""
+
+        data = {
+            'format': self.FORMAT_VERSION,
+            'saved': time.time(),
+            'library': {
+                kind: {
+                    'reloaded': reloaded,
+                    'items': [ self._itemDict(item) for item in items ],
+                } for kind, (items, reloaded) in library.items()
+            },
+        }
+
+        # write to a temporary file first, so an interrupted save keeps the old snapshot
+        print(f"Saving library snapshot {self.filename} ...")
+        with gzip.open(self.filename + '.tmp', 'wt', encoding='utf8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(self.filename + '.tmp', self.filename)
+
+    @staticmethod
+    def _itemDict(item):
+        data = item.asDict()
+        data.pop('tracks', None)  # playlist contents are cached separately
+        return data
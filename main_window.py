@@ -8,6 +8,7 @@ from artist_widget import ArtistWidget
 from album_widget import AlbumWidget
 from track_widget import TrackWidget
 from playlist_widget import PlaylistWidget
+from item_matcher import ItemMatcher
 
 #############################################################################
 
@@ -87,11 +88,14 @@ class MainWindow(QMainWindow):
         super().__init__()
         
         self.is_busy = False
+        self.revalidations = 0  # restored tables still being revalidated
         self.appA = None
         self.appB = None
 
         self.mappingTable = IdMappingTable(self)
         self.mappingTable.load()
+
+        self.matcher = ItemMatcher()
         
         print("Initializing main window ...")
 
@@ -141,6 +145,10 @@ class MainWindow(QMainWindow):
     def closeEvent(self, event):
         self.mappingTable.save()
 
+        for app in (self.appA, self.appB):
+            if app:
+                app.close()
+
     def showMessage(self, msg, timeout=0):
         print(msg)
         if self.wStatusBar:
@@ -152,10 +160,28 @@ class MainWindow(QMainWindow):
             self.wBusyLabel.setText('BUSY')
 
     def done(self):
+        if self.revalidations:
+            return  # still busy until the last revalidation has finished
+
         self.is_busy = False
         if self.wStatusBar:
             self.wBusyLabel.setText('DONE')
 
+    def revalidationStarted(self):
+        self.revalidations += 1
+        self.busy()
+
+    def revalidationFinished(self):
+        self.revalidations -= 1
+
+    def restoreData(self):
+        """Show data from the last session until it is revalidated. Called once
+        both apps are connected."""
+
+        for widget in [ self.wArtistWidget, self.wAlbumWidget, self.wTrackWidget, self.wPlaylistWidget ]:
+            widget.restoreAData()
+            widget.restoreBData()
+
     def setAppA(self, app):
         self.appA = app
         self.appA.connect()
@@ -167,6 +193,9 @@ class MainWindow(QMainWindow):
         self.wTrackWidget.reset()
         self.wPlaylistWidget.reset()
 
+        if self.appA and self.appB:
+            self.restoreData()
+
     def setAppB(self, app):
         self.appB = app
         self.appB.connect()
@@ -177,3 +206,6 @@ class MainWindow(QMainWindow):
         self.wAlbumWidget.reset()
         self.wTrackWidget.reset()
         self.wPlaylistWidget.reset()
+
+        if self.appA and self.appB:
+            self.restoreData()
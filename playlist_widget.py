@@ -9,18 +9,14 @@ from item_types import Playlist
 #############################################################################
 
 class PlaylistWidget(_WidgetTemplate):
+
+    SNAPSHOT_KIND = 'playlists'
+
     def __init__(self, parent):
         super().__init__(parent)
 
         # playlist data
-        self.wTableModelA = PlaylistModel()
-        self.wTableViewA.setModel(self.wTableModelA)
-
-        self.wTableModelB = PlaylistModel()
-        self.wTableViewB.setModel(self.wTableModelB)
-
-        self.wTableModelA.setSiblingModel(self.wTableModelB)
-        self.wTableModelB.setSiblingModel(self.wTableModelA)
+        self.setModels(PlaylistModel(), PlaylistModel())
 
         # track data
         self.wTableTracksModelA = TrackModel()
@@ -50,11 +46,13 @@ class PlaylistWidget(_WidgetTemplate):
         # layout
         self.wLayoutA = QVBoxLayout()
         self.wLayoutA.addWidget(self.wLabelA)
+        self.wLayoutA.addWidget(self.wFilterA)
         self.wLayoutA.addWidget(self.wTableViewA)
         self.wLayoutA.addWidget(self.wTableTracksViewA)
 
         self.wLayoutB = QVBoxLayout()
         self.wLayoutB.addWidget(self.wLabelB)
+        self.wLayoutB.addWidget(self.wFilterB)
         self.wLayoutB.addWidget(self.wTableViewB)
         self.wLayoutB.addWidget(self.wTableTracksViewB)
 
@@ -67,25 +65,19 @@ class PlaylistWidget(_WidgetTemplate):
 
     def selectTableA(self, selected, deselected):
         if selected.indexes():
-            rowIndex = selected.indexes()[0].row()
+            rowIndex = self.sourceRow(self.wTableViewA, selected.indexes()[0])
             playlist = self.wTableModelA.items[rowIndex]
 
             self.wTableTracksModelA.clear()
-            for track in playlist.getTracks():
-                self.wTableTracksModelA.add(track)
-
-            self.wTableTracksModelA.layoutChanged.emit()
+            self.wTableTracksModelA.extend(self.parent.appA.load_playlist_tracks(playlist))
 
     def selectTableB(self, selected, deselected):
        if selected.indexes():
-            rowIndex = selected.indexes()[0].row()
+            rowIndex = self.sourceRow(self.wTableViewB, selected.indexes()[0])
             playlist = self.wTableModelB.items[rowIndex]
 
             self.wTableTracksModelB.clear()
-            for track in playlist.getTracks():
-                self.wTableTracksModelB.add(track)
-
-            self.wTableTracksModelB.layoutChanged.emit()
+            self.wTableTracksModelB.extend(self.parent.appB.load_playlist_tracks(playlist))
 
     def scrollTracksTableA(self):
         """Synchronize B with A scroll bar."""
@@ -99,41 +91,44 @@ class PlaylistWidget(_WidgetTemplate):
 
     def _loadData(self, app, view: QTableView):
 
-        model = view.model()
+        model = self.modelOf(view)
         model.clear()
 
         self.parent.busy()
         print(f"\nLoading {app.name} playlists ...")
-        
-        items = app.get_playlists()
-        playlists = sorted(items, key=lambda x: x.sortKey())
+
+        self._loadPages(app, view, self._iterPages(app))
+
+    def _iterPages(self, app):
+        return app.iter_playlists()
+
+    def _loadFinished(self, app, view: QTableView):
+
+        model = self.modelOf(view)
 
         num_tracks = 0
-        print(f"=> Playlist ({len(playlists)}):")
-        for playlist in playlists:
+        print(f"=> Playlist ({len(model.items)}):")
+        for playlist in model.items:
             print(f"Loaded playlist: {playlist.name}")
-            model.add(playlist)
             num_tracks += playlist.numTracks()
 
-        self.wTableModelA.layoutChanged.emit()
-        self.wTableModelB.layoutChanged.emit()
-        self.wTableTracksModelA.layoutChanged.emit()
-        self.wTableTracksModelB.layoutChanged.emit()
-
         self.parent.showMessage(f"\nLoaded {len(model.items)} playlists with {num_tracks} tracks from {app.name} ...")
         self.parent.done()
 
+        # load playlist contents in the background
+        app.prefetch_playlists(model.items)
+
     def _transferData(self,
                       appA, viewA: QTableView,
                       appB, viewB: QTableView):
 
-        modelA = viewA.model()
-        modelB = viewB.model()
+        modelA = self.modelOf(viewA)
+        modelB = self.modelOf(viewB)
 
         input_playlists = []
         if viewA.selectedIndexes():
             for index in viewA.selectedIndexes():
-                rowIndex = index.row()
+                rowIndex = self.sourceRow(viewA, index)
                 playlist = modelA.items[rowIndex]
 
             input_playlists.append(playlist)
@@ -163,17 +158,21 @@ class PlaylistWidget(_WidgetTemplate):
 
             b_playlist = modelB.find(a_name)
             if not b_playlist:
-                b_playlist = Playlist("", name=a_name, descr=a_playlist.description,
+                b_playlist = Playlist("", name=a_playlist.name, descr=a_playlist.description,
                                       tracks=[], public=a_playlist.public)
                 modelB.insert(b_playlist)
 
             b_playlist.clearTracks()  # clear playlist to ensure correct track order when adding
             b_playlist.setDirty(True)  # mark as dirty to save later
+            modelB.updateStatus([b_playlist.simplifiedName()])
             num_items += 1
 
             # Process playlist's tracks
 
-            for a_track in a_playlist.getTracks():
+            a_tracks = appA.load_playlist_tracks(a_playlist)
+            restored = self._restoreMappings('track', a_tracks, modelB, appB.get_tracks)
+
+            for a_track in a_tracks:
                 a_track_name = a_track.simplifiedName()
                 a_track_id = a_track.id
 
@@ -187,8 +186,8 @@ class PlaylistWidget(_WidgetTemplate):
 
                 # Re-use known mapping
                 b_track_id = self.parent.mappingTable.find('track', a_track_id)
-                if b_track_id:
-                    b_track = appB.get_track(b_track_id)
+                b_track = restored.get(b_track_id) if b_track_id else None
+                if b_track:
                     b_track_name = b_track.simplifiedName()
 
                     print(f"Transfer track: {a_track_name} ({appA.name}:{a_track_id}) => {b_track_name} ({appB.name}:{b_track_id}) [restored]")
@@ -196,34 +195,41 @@ class PlaylistWidget(_WidgetTemplate):
                     num_tracks += 1
                     continue
 
+                # Look up by ISRC code
+                b_track = appB.find_track_by_isrc(a_track.isrc) if a_track.isrc else None
+                if b_track:
+                    b_track_name = b_track.simplifiedName()
+                    b_track_id = str(b_track.id)
+
+                    print(f"Transfer track: {a_track_name} ({appA.name}:{a_track_id}) => {b_track_name} ({appB.name}:{b_track_id}) [isrc]")
+                    b_playlist.addTrack(b_track)
+                    num_tracks += 1
+                    self.parent.mappingTable.add('track', a_track_id, b_track_id)
+                    continue
+
                 # Search by track name
                 query = f"{a_track.artist} - {a_track.album} - {a_track._name}"
                 print("Searching for track:", query)
                 result = appB.search_track(query)
-                if not result:
+
+                # Find best matching track in search results
+                b_track, score = self.parent.matcher.bestMatch(a_track, result)
+                if b_track is None:
                     # Redo search without album name
                     query = f"{a_track.artist} - {a_track._name}"
                     print("Searching for track:", query)
                     result = appB.search_track(query)
+                    b_track, score = self.parent.matcher.bestMatch(a_track, result)
 
-                # Find matching track in search results
-                match = False
-                for b_track in result:
+                match = b_track is not None
+                if match:
                     b_track_name = b_track.simplifiedName()
+                    b_track_id = str(b_track.id)
 
-                    # Must have exact, case-insensitive match
-                    if b_track.name.lower() == a_track.name.lower() \
-                            and b_track.artist.lower() == a_track.artist.lower() \
-                            and b_track.album.lower() == a_track.album.lower():
-                        b_track_id = str(b_track.id)
-
-                        print(f"Transfer track: {a_name} ({appA.name}:{a_track_id}) => {b_track_name} ({appB.name}:{b_track_id}) [matched]")
-                        b_playlist.addTrack(b_track)
-                        num_tracks += 1
-                        self.parent.mappingTable.add('track', a_track_id, b_track_id)
-
-                        match = True
-                        break
+                    print(f"Transfer track: {a_track_name} ({appA.name}:{a_track_id}) => {b_track_name} ({appB.name}:{b_track_id}) [matched {score:.2f}]")
+                    b_playlist.addTrack(b_track)
+                    num_tracks += 1
+                    self.parent.mappingTable.add('track', a_track_id, b_track_id)
 
                 if not match:
                     # Allow to manually specify an track id
@@ -253,11 +259,6 @@ class PlaylistWidget(_WidgetTemplate):
                     else:
                         return
 
-        self.wTableModelA.layoutChanged.emit()
-        self.wTableModelB.layoutChanged.emit()
-        self.wTableTracksModelA.layoutChanged.emit()
-        self.wTableTracksModelB.layoutChanged.emit()
-
         if not viewB.selectedIndexes():
             if len(modelB.items) > 0:
                 viewB.selectRow(0)
@@ -267,7 +268,7 @@ class PlaylistWidget(_WidgetTemplate):
         
     def _submitData(self, app, view: QTableView):
 
-        model = view.model()
+        model = self.modelOf(view)
 
         added_playlists = []
         num_tracks = 0
@@ -284,15 +285,13 @@ class PlaylistWidget(_WidgetTemplate):
 
         #print(added_playlists)
         print(f"Adding {len(added_playlists)} playlists to {app.name} ...")
-        for playlist in added_playlists:
-            app.add_playlist(playlist)
+        app.add_playlists(added_playlists)
 
         dlg = MessageDialog(self, "Success!",
             f"{len(added_playlists)} playlist(s) with {num_tracks} track(s) were added to {app.name}.")
         dlg.exec() 
         
-        self._loadData(app, view)
-
         self.parent.showMessage(f"\nSubmitted {len(added_playlists)} playlists with {num_tracks} tracks to {app.name} ...")
-        self.parent.done()
+
+        self._loadData(app, view)
         
\ No newline at end of file
@@ -0,0 +1,97 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+#############################################################################
+
+SEARCH_CACHE_FILE = 'search-cache.db'
+SEARCH_CACHE_TTL = 30 * 24 * 3600  # seconds
+SEARCH_CACHE_SIZE = 4096  # entries kept in memory
+
+#############################################################################
+
+class SearchCache:
+    """Cache of search results per provider: an in-memory LRU in front of an
+    SQLite store shared by all providers. Entries expire after `ttl` seconds.
+
+    Results are stored as item dicts (see asDict()) and new items are created
+    on every lookup, so callers may modify them freely."""
+
+    def __init__(self, provider: str, filename: str = SEARCH_CACHE_FILE,
+                 ttl: int = SEARCH_CACHE_TTL, max_size: int = SEARCH_CACHE_SIZE):
+        self.provider = provider
+        self.ttl = ttl
+        self.max_size = max_size
+        self.memory = OrderedDict()  # (kind, query) -> (created, [ item dicts ])
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS search ("
+                            " provider TEXT, kind TEXT, query TEXT, created REAL, results TEXT,"
+                            " PRIMARY KEY (provider, kind, query))")
+            self.db.execute("DELETE FROM search WHERE created < ?", (time.time() - self.ttl,))
+
+    @staticmethod
+    def normalizedQuery(query: str):
+        return ' '.join(query.casefold().split())
+
+    def lookup(self, kind: str, query: str, cls, search):
+        """Return the results of `search(query)` as `cls` items, searching
+        only if there is no valid cache entry."""
+
+        key = (kind, self.normalizedQuery(query))
+        results = self._get(key)
+        if results is None:
+            self.misses += 1
+            items = search(query)
+            self._put(key, [ item.asDict() for item in items ])
+            return items
+
+        return [ cls.fromDict(data) for data in results ]
+
+    def _get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            row = self.db.execute("SELECT created, results FROM search WHERE provider=? AND kind=? AND query=?",
+                                  (self.provider, *key)).fetchone()
+            if row and now - row[0] < self.ttl:
+                entry = (row[0], json.loads(row[1]))
+                self._remember(key, entry)
+                self.disk_hits += 1
+                return entry[1]
+
+        return None
+
+    def _put(self, key, results: list):
+        entry = (time.time(), results)
+        with self.lock:
+            self._remember(key, entry)
+            with self.db:
+                self.db.execute("INSERT OR REPLACE INTO search VALUES (?, ?, ?, ?, ?)",
+                                (self.provider, *key, entry[0], json.dumps(results)))
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        return { 'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses }
+
+    def close(self):
+        print(f"Search cache ({self.provider}): {self.hits} hits, {self.disk_hits} disk hits, {self.misses} misses")
+        self.db.close()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import attridict
+import functools
 import html
 import json
 import urllib.parse
@@ -8,7 +8,11 @@ import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 
 from main_window import gMainWindow
-from item_types import Artist, Album, Track, Playlist
+from item_types import Artist, Album, Track, Playlist, ItemRegistry
+from app_utils import fetch_pages, submit_chunks, playlist_delta, SavedItems, PlaylistIndex, PlaylistCache, PlaylistLoader
+from http_session import HttpSession, RateLimiter
+from search_cache import SearchCache
+from library_snapshot import LibrarySnapshot
 from dialogs import InputDialog
 
 ################################################################################
@@ -64,13 +68,42 @@ class SpotifyApp:
         ])
 
     APP_NAME = 'Spotify'
+    PAGE_SIZE = 50
+    PLAYLIST_PAGE_SIZE = 100
+    PLAYLIST_ITEM_FIELDS = 'total,items(track(id,name,duration_ms,external_ids(isrc),artists(name),album(name)))'
+    PLAYLIST_ID_FIELDS = 'total,items(track(id))'
+    ARTIST_BATCH_SIZE = 50  # max. ids per request
+    ALBUM_BATCH_SIZE = 20
+    TRACK_BATCH_SIZE = 50
     SESSION_FILE  = 'spotify-session-oauth.json'
     CLIENT_FILE = 'spotify-api-client.json'
+    PLAYLIST_CACHE_FILE = 'spotify-playlist-cache.json'
+    REQUEST_RATE = 10  # initial requests per second, adapted at runtime
+    MAX_REQUEST_RATE = 30
+    TIMEOUTS = {  # (connect, read) per endpoint
+        r'accounts\.spotify\.com': (5, 10),
+        r'/v1/search': (5, 10),
+        r'/v1/(me|playlists)/': (5, 30),
+    }
        
     def __init__(self):
         
         self.auth = None
         self.sp = None
+        self.limiter = RateLimiter(self.REQUEST_RATE, self.MAX_REQUEST_RATE)
+        self.session = HttpSession(self.TIMEOUTS, limiter=self.limiter)
+        self.registry = ItemRegistry()
+        self.saved_artists = SavedItems()
+        self.saved_albums = SavedItems()
+        self.saved_tracks = SavedItems()
+        self.saved_playlists = SavedItems(full_reload_interval=0)
+        self.snapshot = None
+        self.search_cache = SearchCache(self.APP_NAME)
+        self.playlist_loader = PlaylistLoader(self.get_playlist_tracks)
+        self.playlist_cache = PlaylistCache(self.PLAYLIST_CACHE_FILE)
+        self.playlist_cache.load()
+        self._playlist_index = None
+        self._profile = None
         
         self.client_id: str = ""
         self.client_secret: str = ""
@@ -104,11 +137,48 @@ class SpotifyApp:
                                     client_secret=self.client_secret,
                                     redirect_uri=self.REDIRECT_URI,
                                     cache_path=self.SESSION_FILE,
-                                    scope=self.AUTH_SCOPE)
-
-        self.sp = spotipy.Spotify(auth_manager=self.auth)
+                                    scope=self.AUTH_SCOPE,
+                                    requests_session=self.session,
+                                    requests_timeout=None)
+
+        # timeouts and retries are handled by our session
+        self.sp = spotipy.Spotify(auth_manager=self.auth,
+                                  requests_session=self.session,
+                                  requests_timeout=None)
                 
         self.store_client()
+        self.refresh_profile()
+        self.restore_snapshot()
+
+    def close(self):
+        """Stop background work and store caches."""
+        self.playlist_loader.close()
+        self.playlist_cache.save()
+        self.search_cache.close()
+        self.save_snapshot()
+
+    def restore_snapshot(self):
+        """Load the library snapshot of the connected account (see snapshot_items())."""
+        self.snapshot = LibrarySnapshot(self.APP_NAME, self.uid)
+        library = self.snapshot.load() or {}
+        for kind, (items, reloaded) in library.items():
+            getattr(self, f'saved_{kind}').restore(items, reloaded)
+
+    def save_snapshot(self):
+        if self.snapshot is None:
+            return
+        library = {}
+        for kind in LibrarySnapshot.KINDS:
+            saved = getattr(self, f'saved_{kind}')
+            if saved.items is not None:
+                library[kind] = (saved.items, saved.reloaded)
+        if library:
+            self.snapshot.save(library)
+
+    def snapshot_items(self, kind: str):
+        """Return the artists/albums/tracks/playlists as of the last load or
+        from the snapshot, or None if there are none."""
+        return getattr(self, f'saved_{kind}').items
 
     def restore_client(self):
         
@@ -132,13 +202,34 @@ class SpotifyApp:
     def name(self):
         return self.APP_NAME
 
+    def refresh_profile(self):
+        """Fetch the user profile again (it is cached after connecting)."""
+        result = self.sp.me()
+        self._profile = {
+            'id': result['id'],
+            'display_name': result['display_name'] or "",
+        }
+        return self._profile
+
+    @property
+    def profile(self):
+        if self._profile is None:
+            return self.refresh_profile()
+        return self._profile
+
     @property
     def uid(self):
-        return self.sp.me()['id']
+        return self.profile['id']
 
     @property
     def display_name(self):
-        return self.sp.me()['display_name']
+        return self.profile['display_name']
+
+    @property
+    def workers(self):
+        """Number of concurrent requests the rate limiter currently allows,
+        used to size the worker pools of new fetches."""
+        return int(self.limiter.concurrency)
 
     @staticmethod
     def get_search_url(query):
@@ -146,148 +237,289 @@ class SpotifyApp:
         url = f"https://open.spotify.com/search/{q}"
         return url
 
+    @staticmethod
+    def _artist(x: dict):
+        return Artist(id=x['id'], name=x['name'])
+
+    @staticmethod
+    def _album(x: dict):
+        return Album(id=x['id'], name=x['name'],
+                     artist=x['artists'][0]['name'],
+                     upc=x.get('external_ids', {}).get('upc'))
+
+    @staticmethod
+    def _track(x: dict, make=Track):
+        return make(x['id'], name=x['name'],
+                    artist=x['artists'][0]['name'], album=x['album']['name'],
+                    duration=x['duration_ms'] // 1000,
+                    isrc=x.get('external_ids', {}).get('isrc'))
+
     def search_artist(self, name):
+        return self.search_cache.lookup('artist', name, Artist, self._search_artist)
+
+    def _search_artist(self, name):
         result = self.sp.search(name, limit=10, type='artist')
         #print(result)
-        items = [ attridict(r) for r in result['artists']['items'] ]
-        return [ Artist( id=x.id, name=x.name)
-                for x in items ]
+        return [ self._artist(x) for x in result['artists']['items'] ]
 
     def search_album(self, name):
+        return self.search_cache.lookup('album', name, Album, self._search_album)
+
+    def _search_album(self, name):
         result = self.sp.search(name, limit=10, type='album')
         #print(result)
-        items = [ attridict(r) for r in result['albums']['items'] ]
-        return [ Album( id=x.id, name=x.name,
-                       artist=x.artists[0].name)
-                for x in items ]
+        return [ self._album(x) for x in result['albums']['items'] ]
 
     def search_track(self, name):
+        return self.search_cache.lookup('track', name, Track, self._search_track)
+
+    def _search_track(self, name):
         result = self.sp.search(name, limit=10, type='track')
         #print(result)
-        items = [ attridict(r) for r in result['tracks']['items'] ]
-        return [ Track( id=x.id, name=x.name,
-                       artist=x.artists[0].name, album=x.album.name)
-                for x in items ]
+        return [ self._track(x) for x in result['tracks']['items'] ]
 
-    def get_saved_artists(self):
-        items = []
-        after = None
-        # accumulate data from multiple requests
-        while True:
-            result = self.sp.current_user_followed_artists(limit=50, after=after)
-            #print(result)
-            items.extend([ attridict(r) for r in result['artists']['items'] ])
-            if result['artists']['next'] is None:
-                break
-            after = result['artists']['cursors']['after']
-            assert after is not None
+    def _get_batched(self, fetch, key: str, parse, ids: list, batch_size: int):
+        """Fetch items by id in concurrent batches, in order (None for unknown ids)."""
+        ids = list(ids)
+        pages = fetch_pages(lambda offset: fetch(ids[offset:offset + batch_size]),
+                            batch_size, total=len(ids), max_workers=self.workers)
+        return [ parse(x) if x else None
+                for result in pages for x in result[key] ]
 
-        return [ Artist(id=ar.id, name=ar.name)
-                for ar in items ]
+    def get_artists(self, ids: list):
+        return self._get_batched(self.sp.artists, 'artists', self._artist, ids, self.ARTIST_BATCH_SIZE)
 
-    def get_saved_albums(self):
-        items = []
-        offset = 0
-        while True:
-            result = self.sp.current_user_saved_albums(limit=50, offset=offset)
-            #print(result)
-            items.extend([ attridict(r) for r in result['items'] ])
-            if result['next'] is None:
-                break
-            offset += 50
+    def get_albums(self, ids: list):
+        return self._get_batched(self.sp.albums, 'albums', self._album, ids, self.ALBUM_BATCH_SIZE)
+
+    def get_tracks(self, ids: list):
+        return self._get_batched(self.sp.tracks, 'tracks', self._track, ids, self.TRACK_BATCH_SIZE)
 
-        return [ Album(id=al.album.id, name=al.album.name,
-                       artist=al.album.artists[0].name)
-                for al in items ]
+    def get_artist(self, id):
+        return self.get_artists([id])[0]
 
-    def get_saved_tracks(self):
-        items = []
+    def get_album(self, id):
+        return self.get_albums([id])[0]
+
+    def get_track(self, id):
+        return self.get_tracks([id])[0]
+
+    @staticmethod
+    def _iter_offset_pages(fetch, page_size: int):
+        """Yield pages of an offset-paginated endpoint one request at a time
+        (unlike fetch_pages(), nothing is read ahead of the consumer)."""
         offset = 0
         while True:
-            result = self.sp.current_user_saved_tracks(limit=50, offset=offset)
-            #print(result)
-            items.extend([ attridict(r) for r in result['items'] ])
+            result = fetch(limit=page_size, offset=offset)
+            yield result
             if result['next'] is None:
                 break
-            offset += 50
+            offset += page_size
 
-        return [ Track(id=tr.track.id, name=tr.track.name,
-                       artist=tr.track.artists[0].name, album=tr.track.album.name)
-                for tr in items ]
+    def iter_saved_artists(self, incremental: bool = False):
+        """Yield saved artists page by page."""
+        # followed artists are not ordered by date, so they are always reloaded completely
+        return self.saved_artists.load(self._iter_saved_artists())
 
-    def get_playlists(self):
-        items = []
-        offset = 0
+    def _iter_saved_artists(self):
+        after = None
         while True:
-            result = self.sp.current_user_playlists(limit=50, offset=offset)
+            result = self.sp.current_user_followed_artists(limit=50, after=after)
             #print(result)
-            items.extend([ attridict(r) for r in result['items'] ])
-            if result['next'] is None:
+            yield [ self._artist(ar) for ar in result['artists']['items'] ]
+            if result['artists']['next'] is None:
                 break
-            offset += 50
-
-        filled_items = []
-        for pl in items:
-            tracks = self.get_playlist_items(pl.id)
+            after = result['artists']['cursors']['after']
+            assert after is not None
 
-            filled_items.append(Playlist(id=pl.id, 
-                                         name=pl.name, 
-                                         descr=html.unescape(pl.description),
-                                         tracks=tracks, 
-                                         public=pl.public, 
-                                         image_url=pl.images[0]['url'] if pl.images else ""))
+    def iter_saved_albums(self, incremental: bool = False):
+        """Yield saved albums page by page. If `incremental`, only albums
+        added since the last load are fetched (see SavedItems)."""
+        def parse(pages):
+            for result in pages:
+                #print(result)
+                yield [ self._album(al['album']) for al in result['items'] ]
+
+        # saved albums are returned newest first
+        pages = fetch_pages(lambda offset: self.sp.current_user_saved_albums(limit=self.PAGE_SIZE, offset=offset),
+                            self.PAGE_SIZE, max_workers=self.workers)
+        new_pages = self._iter_offset_pages(self.sp.current_user_saved_albums, self.PAGE_SIZE) if incremental else None
+        return self.saved_albums.load(parse(pages), new_pages and parse(new_pages))
+
+    def iter_saved_tracks(self, incremental: bool = False):
+        """Yield saved tracks page by page. If `incremental`, only tracks
+        added since the last load are fetched (see SavedItems)."""
+        def parse(pages):
+            for result in pages:
+                #print(result)
+                yield [ self._track(tr['track']) for tr in result['items'] ]
+
+        # saved tracks are returned newest first
+        pages = fetch_pages(lambda offset: self.sp.current_user_saved_tracks(limit=self.PAGE_SIZE, offset=offset),
+                            self.PAGE_SIZE, max_workers=self.workers)
+        new_pages = self._iter_offset_pages(self.sp.current_user_saved_tracks, self.PAGE_SIZE) if incremental else None
+        return self.saved_tracks.load(parse(pages), new_pages and parse(new_pages))
+
+    def iter_playlists(self):
+        """Yield playlists page by page, without tracks (see load_playlist_tracks())."""
+        return self.saved_playlists.load(self._iter_playlists())
+
+    def _iter_playlists(self):
+        self.playlist_loader.cancel()
+        self._playlist_index = None
+
+        playlist_ids = []
+        pages = fetch_pages(lambda offset: self.sp.current_user_playlists(limit=self.PAGE_SIZE, offset=offset),
+                            self.PAGE_SIZE, max_workers=self.workers)
+        for result in pages:
+            #print(result)
+            items = result['items']
+            playlist_ids.extend(pl['id'] for pl in items)
+            yield [ Playlist(id=pl['id'], 
+                             name=pl['name'], 
+                             descr=html.unescape(pl['description'] or ""),
+                             public=pl['public'], 
+                             image_url=pl['images'][0]['url'] if pl['images'] else "",
+                             num_tracks=pl['tracks']['total'],
+                             version=pl['snapshot_id'])
+                   for pl in items ]
+
+        self.playlist_cache.prune(playlist_ids)
+
+    def get_playlist_tracks(self, playlist: Playlist):
+        """Return the playlist's tracks, from the cache if the playlist did not change."""
+        cached = self.playlist_cache.get(playlist)
+        if cached is not None:
+            return [ self.registry.get(Track, **tr) for tr in cached ]
+
+        tracks = self.get_playlist_items(playlist.id)
+        self.playlist_cache.put(playlist, tracks)
+        return tracks
+
+    def load_playlist_tracks(self, playlist: Playlist):
+        """Return the playlist's tracks, fetching them first if necessary."""
+        return self.playlist_loader.load(playlist)
+
+    def prefetch_playlists(self, playlists: list[Playlist]):
+        """Fetch tracks of the given playlists in the background."""
+        self.playlist_loader.prefetch(playlists)
+
+    def _search_isrc(self, isrc: str):
+        result = self.sp.search(f"isrc:{isrc}", limit=1, type='track')
+        return [ self._track(x) for x in result['tracks']['items'] ]
+
+    def find_track_by_isrc(self, isrc: str):
+        """Return the track with the given ISRC code, or None."""
+        return next(iter(self.search_cache.lookup('isrc', isrc, Track, self._search_isrc)), None)
+
+    def _search_upc(self, upc: str):
+        result = self.sp.search(f"upc:{upc}", limit=1, type='album')
+        return [ Album(id=x['id'], name=x['name'],
+                       artist=x['artists'][0]['name'], upc=upc)
+                for x in result['albums']['items'] ]
+
+    def find_album_by_upc(self, upc: str):
+        """Return the album with the given UPC code, or None."""
+        return next(iter(self.search_cache.lookup('upc', upc, Album, self._search_upc)), None)
+
+    def get_saved_artists(self, incremental: bool = False):
+        return [ ar for page in self.iter_saved_artists(incremental) for ar in page ]
+
+    def get_saved_albums(self, incremental: bool = False):
+        return [ al for page in self.iter_saved_albums(incremental) for al in page ]
+
+    def get_saved_tracks(self, incremental: bool = False):
+        return [ tr for page in self.iter_saved_tracks(incremental) for tr in page ]
 
-        return filled_items
+    def get_playlists(self):
+        return [ pl for page in self.iter_playlists() for pl in page ]
+
+    def iter_playlist_items(self, playlist_id: str):
+        """Yield the tracks of a playlist page by page."""
+        make = functools.partial(self.registry.get, Track)
+        pages = fetch_pages(lambda offset: self.sp.playlist_items(playlist_id, fields=self.PLAYLIST_ITEM_FIELDS,
+                                                                  limit=self.PLAYLIST_PAGE_SIZE, offset=offset),
+                            self.PLAYLIST_PAGE_SIZE, max_workers=self.workers)
+        for result in pages:
+            #print(result)
+            yield [ self._track(tr['track'], make)
+                   for tr in result['items'] if tr['track'] ]  # skip unavailable items
 
     def get_playlist_items(self, playlist_id: str):
-        items = []
-        offset = 0
-        while True:
-            result = self.sp.playlist_items(playlist_id, limit=50, offset=offset)
-            #print(result)
-            items.extend([ attridict(r) for r in result['items'] ])
-            if result['next'] is None:
-                break
-            offset += 50
+        return [ tr for page in self.iter_playlist_items(playlist_id) for tr in page ]
 
-        return [ Track(id=tr.track.id, name=tr.track.name,
-                       artist=tr.track.artists[0].name, album=tr.track.album.name)
-                for tr in items ]
+    def get_playlist_item_ids(self, playlist_id: str):
+        """Return the track ids of a playlist with None for unavailable items and
+        local files, so that list positions match the remote playlist."""
+        pages = fetch_pages(lambda offset: self.sp.playlist_items(playlist_id, fields=self.PLAYLIST_ID_FIELDS,
+                                                                  limit=self.PLAYLIST_PAGE_SIZE, offset=offset),
+                            self.PLAYLIST_PAGE_SIZE, max_workers=self.workers)
+        return [ tr['track']['id'] if tr['track'] else None
+                 for result in pages for tr in result['items'] ]
 
     def add_saved_artists(self, artists: list[Artist]):
-        return self.sp.user_follow_artists([ ar.id for ar in artists ])
+        """Follow artists, returns the lists of submitted and failed artists."""
+        return submit_chunks(lambda chunk: self.sp.user_follow_artists([ ar.id for ar in chunk ]),
+                             artists, self.ARTIST_BATCH_SIZE, self.workers)
 
     def add_saved_albums(self, albums: list[Album]):
-        return self.sp.current_user_saved_albums_add([ al.id for al in albums ])
+        """Save albums, returns the lists of submitted and failed albums."""
+        return submit_chunks(lambda chunk: self.sp.current_user_saved_albums_add([ al.id for al in chunk ]),
+                             albums, self.ALBUM_BATCH_SIZE, self.workers)
 
     def add_saved_tracks(self, tracks: list[Track]):
-        return self.sp.current_user_saved_tracks_add([ tr.id for tr in tracks ])
+        """Save tracks, returns the lists of submitted and failed tracks."""
+        return submit_chunks(lambda chunk: self.sp.current_user_saved_tracks_add([ tr.id for tr in chunk ]),
+                             tracks, self.TRACK_BATCH_SIZE, self.workers)
         
+    def playlist_index(self):
+        """Return the index of the user's playlists, listing them only once."""
+        if self._playlist_index is None:
+            pages = fetch_pages(lambda offset: self.sp.current_user_playlists(limit=self.PAGE_SIZE, offset=offset),
+                                self.PAGE_SIZE, max_workers=self.workers)
+            self._playlist_index = PlaylistIndex((item['id'], item['name'], item['snapshot_id'])
+                                                 for result in pages for item in result['items'])
+        return self._playlist_index
+
+    def add_playlists(self, playlists: list[Playlist]):
+        """Submit several playlists, listing the remote playlists only once."""
+        self._playlist_index = None
+        return [ self.add_playlist(playlist) for playlist in playlists ]
+
     def add_playlist(self, playlist: Playlist):
+        index = self.playlist_index()
+
         # first try to find existing playlist
-        pl_id = None
+        entry = index.find(playlist)
+        if entry:
+            pl_id, snapshot_id = entry
+            current = self.get_playlist_item_ids(pl_id)
 
-        offset = 0
-        while pl_id is None:
-            result = self.sp.current_user_playlists(limit=50, offset=offset)
-            #print(result)
-            for item in result['items']:
-                if item['id'] == playlist.id:
-                    pl_id = item['id']
-                    break
-                if item['name'] == playlist.name:
-                    pl_id = item['id']
-                    break                
-            if result['next'] is None:
-                break
-            offset += 50            
-        
         # otherwise create new
-        if not pl_id:
-            pl_id = self.sp.user_playlist_create(self.uid, playlist.name)
-        
-        for tracks in playlist.getTracks(chunk_size=50):
-            self.sp.playlist_replace_items(pl_id, [ tr.id for tr in tracks ])
+        else:
+            result = self.sp.user_playlist_create(self.uid, playlist.name)
+            pl_id, snapshot_id = result['id'], result['snapshot_id']
+            current = []
+
+        # only send the differences to the remote playlist
+        removals, insertions = playlist_delta(current, [ tr.id for tr in playlist.getTracks() ])
+        print(f"Updating playlist {playlist.name}: {len(removals)} removed, "
+              f"{sum(len(ids) for _, ids in insertions)} added")
+
+        # all removals refer to positions in the original snapshot
+        version = snapshot_id
+        for i in range(0, len(removals), self.PLAYLIST_PAGE_SIZE):
+            result = self.sp.playlist_remove_specific_occurrences_of_items(pl_id,
+                [ { 'uri': current[pos], 'positions': [ pos ] } for pos in removals[i:i + self.PLAYLIST_PAGE_SIZE] ],
+                snapshot_id=snapshot_id)
+            version = result['snapshot_id']
+
+        for position, ids in insertions:
+            for i in range(0, len(ids), self.PLAYLIST_PAGE_SIZE):
+                result = self.sp.playlist_add_items(pl_id, ids[i:i + self.PLAYLIST_PAGE_SIZE], position=position + i)
+                version = result['snapshot_id']
+
+        index.add(pl_id, playlist.name, version)
         
         self.sp.playlist_change_details(pl_id, 
             public=playlist.public, description=html.escape(playlist.description))
@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 
+import functools
 from pathlib import Path
 import urllib.parse
 from typing import Callable
+import requests
 import tidalapi
+from tidalapi.types import ItemOrder, OrderDirection
 
 from main_window import gMainWindow
-from item_types import Artist, Album, Track, Playlist
+from item_types import Artist, Album, Track, Playlist, ItemRegistry
+from app_utils import fetch_pages, map_concurrent, submit_chunks, playlist_delta, SavedItems, PlaylistIndex, PlaylistCache, PlaylistLoader
+from http_session import HttpSession, RateLimiter
+from search_cache import SearchCache
+from library_snapshot import LibrarySnapshot
 from dialogs import MessageDialog, InputDialog
 
 ################################################################################
@@ -79,12 +86,37 @@ class TidalApp:
     
     APP_NAME = 'Tidal'
     SESSION_FILE = 'tidal-session-oauth.json'
+    PLAYLIST_CACHE_FILE = 'tidal-playlist-cache.json'
+    PAGE_SIZE = 100
+    SUBMIT_BATCH_SIZE = 50  # max. ids per favorites request
+    REQUEST_RATE = 5  # initial requests per second, adapted at runtime
+    MAX_REQUEST_RATE = 20
+    TIMEOUTS = {  # (connect, read) per endpoint
+        r'auth\.tidal\.com': (5, 10),
+        r'/v1/search': (5, 10),
+        r'/v1/(playlists|users)/': (5, 30),
+    }
 
     def __init__(self):
         
         self.td = None
+        self.limiter = RateLimiter(self.REQUEST_RATE, self.MAX_REQUEST_RATE)
+        self.session = HttpSession(self.TIMEOUTS, limiter=self.limiter)
         self.user = None
         self.fav = None
+        self.registry = ItemRegistry()
+        self.saved_artists = SavedItems()
+        self.saved_albums = SavedItems()
+        self.saved_tracks = SavedItems()
+        self.saved_playlists = SavedItems(full_reload_interval=0)
+        self.snapshot = None
+        self.search_cache = SearchCache(self.APP_NAME)
+        self.tidal_playlists = {}  # id -> tidalapi playlist
+        self.playlist_loader = PlaylistLoader(self.get_playlist_tracks)
+        self.playlist_cache = PlaylistCache(self.PLAYLIST_CACHE_FILE)
+        self.playlist_cache.load()
+        self._playlist_index = None
+        self._profile = None
 
         self.client_id: str = ""
         self.client_secret: str = ""
@@ -92,22 +124,76 @@ class TidalApp:
     def connect(self):
         
         self.td = GuiTidalSession()
+        self.td.request_session = self.session  # timeouts and retries are handled by our session
         self.td.login_session_file(Path(self.SESSION_FILE))
 
         self.user = self.td.user
+        self.refresh_profile()
+        self.restore_snapshot()
         self.fav = tidalapi.Favorites(session=self.td, user_id=self.uid)
 
+    def close(self):
+        """Stop background work and store caches."""
+        self.playlist_loader.close()
+        self.playlist_cache.save()
+        self.search_cache.close()
+        self.save_snapshot()
+
+    def restore_snapshot(self):
+        """Load the library snapshot of the connected account (see snapshot_items())."""
+        self.snapshot = LibrarySnapshot(self.APP_NAME, self.uid)
+        library = self.snapshot.load() or {}
+        for kind, (items, reloaded) in library.items():
+            getattr(self, f'saved_{kind}').restore(items, reloaded)
+
+    def save_snapshot(self):
+        if self.snapshot is None:
+            return
+        library = {}
+        for kind in LibrarySnapshot.KINDS:
+            saved = getattr(self, f'saved_{kind}')
+            if saved.items is not None:
+                library[kind] = (saved.items, saved.reloaded)
+        if library:
+            self.snapshot.save(library)
+
+    def snapshot_items(self, kind: str):
+        """Return the artists/albums/tracks/playlists as of the last load or
+        from the snapshot, or None if there are none."""
+        return getattr(self, f'saved_{kind}').items
+
     @property
     def name(self):
         return self.APP_NAME
 
+    def refresh_profile(self):
+        """Fetch the user profile again (it is cached after connecting)."""
+        self.user = self.td.get_user(self.user.id)
+        self._profile = {
+            'id': self.user.id,
+            'display_name': f"{self.user.first_name or ''} {self.user.last_name or ''}",
+        }
+        return self._profile
+
+    @property
+    def profile(self):
+        if self._profile is None:
+            return self.refresh_profile()
+        return self._profile
+
     @property
     def uid(self):
-        return self.user.id
+        return self.profile['id']
 
     @property
     def display_name(self):
-        return f"{self.user.first_name or ''} {self.user.last_name or ''}"
+        return self.profile['display_name']
+
+    @property
+    def workers(self):
+        """Number of concurrent requests the rate limiter currently allows,
+        used to size the worker pools of new fetches."""
+        return int(self.limiter.concurrency)
 
     @staticmethod
     def get_search_url(query):
@@ -116,6 +202,9 @@ class TidalApp:
         return url
 
     def search_artist(self, name):
+        return self.search_cache.lookup('artist', name, Artist, self._search_artist)
+
+    def _search_artist(self, name):
         result = self.td.search(name, limit=10, models=[tidalapi.Artist])
         #print(result)
         items = result['artists']
@@ -123,19 +212,27 @@ class TidalApp:
                 for ar in items]
 
     def search_album(self, name):
+        return self.search_cache.lookup('album', name, Album, self._search_album)
+
+    def _search_album(self, name):
         result = self.td.search(name, limit=10, models=[tidalapi.Album])
         #print(result)
         items = result['albums']
         return [ Album(id=al.id, name=al.name,
-                       artist=al.artists[0].name)
+                       artist=al.artists[0].name,
+                       upc=al.universal_product_number)
                 for al in items]
 
     def search_track(self, name):
+        return self.search_cache.lookup('track', name, Track, self._search_track)
+
+    def _search_track(self, name):
         result = self.td.search(name, limit=10, models=[tidalapi.Track])
         #print(result)
         items = result['tracks']
         return [ Track(id=tr.id, name=tr.name,
-                       artist=tr.artists[0].name, album=tr.album.name)
+                       artist=tr.artists[0].name, album=tr.album.name,
+                       duration=tr.duration, isrc=tr.isrc)
                 for tr in items]
 
     def get_artist(self, id):
@@ -145,74 +242,232 @@ class TidalApp:
     def get_album(self, id):
         result = self.td.album(id)
         return Album(id=result.id, name=result.name,
-                     artist=result.artists[0].name)
+                     artist=result.artists[0].name,
+                     upc=result.universal_product_number)
 
     def get_track(self, id):
         result = self.td.track(id)
         return Track(id=result.id, name=result.name,
-                     artist=result.artists[0].name, album=result.album.name)
+                     artist=result.artists[0].name, album=result.album.name,
+                     duration=result.duration, isrc=result.isrc)
 
-    def get_saved_artists(self):
-        result = self.fav.artists()
-        #print(result)
-        return [ Artist(id=ar.id, name=ar.name)
-                for ar in result ]
+    def _get_concurrent(self, get_item, ids: list):
+        """Fetch items by id concurrently, in order (None for unknown ids)."""
+        def get(id):
+            try:
+                return get_item(id)
+            except tidalapi.exceptions.ObjectNotFound:
+                return None
 
-    def get_saved_albums(self):
-        result = self.fav.albums()
-        #print(result)
-        return [ Album(id=al.id, name=al.name,
-                       artist=al.artists[0].name)
-                for al in result ]
+        return map_concurrent(get, ids, self.workers)
+
+    def get_artists(self, ids: list):
+        return self._get_concurrent(self.get_artist, ids)
+
+    def get_albums(self, ids: list):
+        return self._get_concurrent(self.get_album, ids)
+
+    def get_tracks(self, ids: list):
+        return self._get_concurrent(self.get_track, ids)
+
+    @staticmethod
+    def _iter_pages(fn, page_size=PAGE_SIZE):
+        offset = 0
+        while True:
+            result = fn(limit=page_size, offset=offset)
+            #print(result)
+            yield result
+            if len(result) < page_size:
+                break
+            offset += page_size
+
+    def _iter_saved(self, saved: SavedItems, fn, parse, incremental: bool):
+        """Yield saved items page by page. If `incremental`, only items added
+        since the last load are fetched (see SavedItems)."""
+        def parse_pages(pages):
+            for result in pages:
+                #print(result)
+                yield [ parse(x) for x in result ]
+
+        newest_first = functools.partial(fn, order=ItemOrder.Date, order_direction=OrderDirection.Descending)
+        pages = parse_pages(self._iter_pages(fn))
+        new_pages = parse_pages(self._iter_pages(newest_first)) if incremental else None
+        return saved.load(pages, new_pages)
+
+    def iter_saved_artists(self, incremental: bool = False):
+        """Yield saved artists page by page."""
+        return self._iter_saved(self.saved_artists, self.fav.artists,
+                                lambda ar: Artist(id=ar.id, name=ar.name),
+                                incremental)
+
+    def iter_saved_albums(self, incremental: bool = False):
+        """Yield saved albums page by page."""
+        return self._iter_saved(self.saved_albums, self.fav.albums,
+                                lambda al: Album(id=al.id, name=al.name,
+                                                 artist=al.artists[0].name,
+                                                 upc=al.universal_product_number),
+                                incremental)
+
+    def iter_saved_tracks(self, incremental: bool = False):
+        """Yield saved tracks page by page."""
+        return self._iter_saved(self.saved_tracks, self.fav.tracks,
+                                lambda tr: Track(id=tr.id, name=tr.name,
+                                                 artist=tr.artists[0].name, album=tr.album.name,
+                                                 duration=tr.duration, isrc=tr.isrc),
+                                incremental)
+
+    def iter_playlists(self):
+        """Yield playlists (as a single page), without tracks (see load_playlist_tracks())."""
+        return self.saved_playlists.load(self._iter_playlists())
+
+    def _iter_playlists(self):
+        self.playlist_loader.cancel()
+        self._playlist_index = None
 
-    def get_saved_tracks(self):
-        result = self.fav.tracks()
+        result = self.user.playlists()
         #print(result)
+        self.tidal_playlists = { pl.id: pl for pl in result }
+        self.playlist_cache.prune(self.tidal_playlists)
+        yield [ Playlist(id=pl.id, 
+                         name=pl.name, 
+                         descr=pl.description,
+                         public=pl.public, 
+                         image_url=pl.picture,
+                         num_tracks=pl.num_tracks,
+                         version=pl.last_updated.isoformat() if pl.last_updated else "")
+               for pl in result ]
+
+    def get_playlist_tracks(self, playlist: Playlist):
+        """Return the playlist's tracks, from the cache if the playlist did not change."""
+        cached = self.playlist_cache.get(playlist)
+        if cached is not None:
+            return [ self.registry.get(Track, **tr) for tr in cached ]
+
+        pl = self.tidal_playlists.get(playlist.id) or self.td.playlist(playlist.id)
+        pages = fetch_pages(lambda offset: pl.tracks(limit=self.PAGE_SIZE, offset=offset),
+                            self.PAGE_SIZE, total=pl.num_tracks, max_workers=self.workers)
+
+        tracks = [ self.registry.get(Track, tr.id, name=tr.name,
+                                     artist=tr.artists[0].name, album=tr.album.name,
+                                     duration=tr.duration, isrc=tr.isrc)
+                  for page in pages for tr in page ]
+        self.playlist_cache.put(playlist, tracks)
+        return tracks
+
+    def load_playlist_tracks(self, playlist: Playlist):
+        """Return the playlist's tracks, fetching them first if necessary."""
+        return self.playlist_loader.load(playlist)
+
+    def prefetch_playlists(self, playlists: list[Playlist]):
+        """Fetch tracks of the given playlists in the background."""
+        self.playlist_loader.prefetch(playlists)
+
+    def _search_isrc(self, isrc: str):
+        try:
+            result = self.td.get_tracks_by_isrc(isrc)
+        except (tidalapi.exceptions.ObjectNotFound, tidalapi.exceptions.InvalidISRC):
+            # unknown or malformed code, the caller falls back to a text search
+            result = []
         return [ Track(id=tr.id, name=tr.name,
-                       artist=tr.artists[0].name, album=tr.album.name)
+                       artist=tr.artists[0].name, album=tr.album.name,
+                       duration=tr.duration, isrc=isrc)
                 for tr in result ]
 
+    def find_track_by_isrc(self, isrc: str):
+        """Return the track with the given ISRC code, or None."""
+        return next(iter(self.search_cache.lookup('isrc', isrc, Track, self._search_isrc)), None)
+
+    def _search_upc(self, upc: str):
+        try:
+            result = self.td.get_albums_by_barcode(upc)
+        except (tidalapi.exceptions.ObjectNotFound, tidalapi.exceptions.InvalidUPC):
+            result = []
+        return [ Album(id=al.id, name=al.name,
+                       artist=al.artists[0].name, upc=upc)
+                for al in result ]
+
+    def find_album_by_upc(self, upc: str):
+        """Return the album with the given UPC code, or None."""
+        return next(iter(self.search_cache.lookup('upc', upc, Album, self._search_upc)), None)
+
+    def get_saved_artists(self, incremental: bool = False):
+        return [ ar for page in self.iter_saved_artists(incremental) for ar in page ]
+
+    def get_saved_albums(self, incremental: bool = False):
+        return [ al for page in self.iter_saved_albums(incremental) for al in page ]
+
+    def get_saved_tracks(self, incremental: bool = False):
+        return [ tr for page in self.iter_saved_tracks(incremental) for tr in page ]
+
     def get_playlists(self):
-        result = self.user.playlists()
-        #print(result)
-        return [ Playlist(id=pl.id, 
-                          name=pl.name, 
-                          descr=pl.description,
-                          tracks=[ Track(id=tr.id, name=tr.name,
-                                         artist=tr.artists[0].name, album=tr.album.name)
-                                  for tr in pl.tracks() ],
-                          public=pl.public, 
-                          image_url=pl.picture)
-                 for pl in result ]
+        return [ pl for page in self.iter_playlists() for pl in page ]
+
+    def _add_favorites(self, add, items: list):
+        def submit(chunk):
+            # tidalapi reports failed requests as a False return value,
+            # raise with the response so that submit_chunks() sees the status
+            if add([ x.id for x in chunk ]) is False:
+                raise requests.HTTPError("request failed", response=self.session.lastResponse())
+
+        return submit_chunks(submit, items, self.SUBMIT_BATCH_SIZE, self.workers)
 
     def add_saved_artists(self, artists: list[Artist]):
-        return self.fav.add_artist([ ar.id for ar in artists ])
+        """Favorite artists, returns the lists of submitted and failed artists."""
+        return self._add_favorites(self.fav.add_artist, artists)
 
     def add_saved_albums(self, albums: list[Album]):
-        return self.fav.add_album([ al.id for al in albums ])
+        """Favorite albums, returns the lists of submitted and failed albums."""
+        return self._add_favorites(self.fav.add_album, albums)
 
     def add_saved_tracks(self, tracks: list[Track]):
-        return self.fav.add_track([ tr.id for tr in tracks ])
+        """Favorite tracks, returns the lists of submitted and failed tracks."""
+        return self._add_favorites(self.fav.add_track, tracks)
+
+    def playlist_index(self):
+        """Return the index of the user's playlists, listing them only once."""
+        if self._playlist_index is None:
+            result = self.user.playlists()
+            self.tidal_playlists = { pl.id: pl for pl in result }
+            self._playlist_index = PlaylistIndex((pl.id, pl.name, pl.last_updated.isoformat() if pl.last_updated else "")
+                                                 for pl in result)
+        return self._playlist_index
+
+    def add_playlists(self, playlists: list[Playlist]):
+        """Submit several playlists, listing the remote playlists only once."""
+        self._playlist_index = None
+        return [ self.add_playlist(playlist) for playlist in playlists ]
 
     def add_playlist(self, playlist: Playlist):
+        index = self.playlist_index()
+
         # first try to find existing playlist
-        pl = None
-        for item in self.user.playlists():
-            if item.id == playlist.id:
-                pl = item
-                break
-            if item.name == playlist.name:
-                pl = item
-                break
+        entry = index.find(playlist)
+        if entry:
+            pl = self.tidal_playlists.get(entry[0]) or self.td.playlist(entry[0])
+            # remove_by_indices() and add(position=) count all items including
+            # videos, keep placeholders so that positions match
+            pages = fetch_pages(lambda offset: pl.items(limit=self.PAGE_SIZE, offset=offset),
+                                self.PAGE_SIZE, total=pl.num_tracks + pl.num_videos, max_workers=self.workers)
+            current = [ str(item.id) if isinstance(item, tidalapi.Track) and item.available else None
+                        for page in pages for item in page ]
 
         # otherwise create new
-        if not pl:
+        else:
             pl = self.user.create_playlist(playlist.name, playlist.description)
+            self.tidal_playlists[pl.id] = pl
+            current = []
 
-        # clear playlist and add tracks
-        pl.clear()
-        for tracks in playlist.getTracks(chunk_size=50):
-            pl.add([ tr.id for tr in tracks ], allow_duplicates=True)
+        # only send the differences to the remote playlist (compare ids as strings,
+        # tidalapi returns ints but restored or mapped tracks may carry strings)
+        removals, insertions = playlist_delta(current, [ str(tr.id) for tr in playlist.getTracks() ])
+        print(f"Updating playlist {playlist.name}: {len(removals)} removed, "
+              f"{sum(len(ids) for _, ids in insertions)} added")
+
+        if removals:
+            pl.remove_by_indices(removals)
+        for position, ids in insertions:
+            for i in range(0, len(ids), self.SUBMIT_BATCH_SIZE):
+                pl.add(ids[i:i + self.SUBMIT_BATCH_SIZE], allow_duplicates=True, position=position + i)
 
         # update playlist details
         if playlist.public:
@@ -220,6 +475,10 @@ class TidalApp:
         else:
             pl.set_playlist_private()
 
+        # the edits changed last_updated, read it back
+        pl = self.tidal_playlists[pl.id] = self.td.playlist(pl.id)
+        index.add(pl.id, playlist.name, pl.last_updated.isoformat() if pl.last_updated else "")
+
         return self.fav.add_playlist(pl.id)
 
 if __name__ == "__main__":
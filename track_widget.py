@@ -7,18 +7,14 @@ from item_models import TrackModel
 #############################################################################
 
 class TrackWidget(_WidgetTemplate):
+
+    SNAPSHOT_KIND = 'tracks'
+
     def __init__(self, parent):
         super().__init__(parent)
 
         # track data
-        self.wTableModelA = TrackModel()
-        self.wTableViewA.setModel(self.wTableModelA)
-
-        self.wTableModelB = TrackModel()
-        self.wTableViewB.setModel(self.wTableModelB)
-
-        self.wTableModelA.setSiblingModel(self.wTableModelB)
-        self.wTableModelB.setSiblingModel(self.wTableModelA)
+        self.setModels(TrackModel(), TrackModel())
 
         # layout
         self.wLayout = QHBoxLayout()
@@ -30,22 +26,24 @@ class TrackWidget(_WidgetTemplate):
 
     def _loadData(self, app, view: QTableView):
 
-        model = view.model()
+        model = self.modelOf(view)
         model.clear()
         
         self.parent.busy()
         print(f"\nLoading {app.name} tracks ...")
-        
-        items = app.get_saved_tracks()
-        tracks = sorted(items, key=lambda x: x.sortKey())
 
-        print(f"=> Tracks ({len(tracks)}):")
-        for track in tracks:
-            print(f"Loaded track: {track.name}")
-            model.add(track)
+        self._loadPages(app, view, self._iterPages(app))
+
+    def _iterPages(self, app):
+        return app.iter_saved_tracks(incremental=True)
+
+    def _loadFinished(self, app, view: QTableView):
 
-        self.wTableModelA.layoutChanged.emit()
-        self.wTableModelB.layoutChanged.emit()
+        model = self.modelOf(view)
+
+        print(f"=> Tracks ({len(model.items)}):")
+        for track in model.items:
+            print(f"Loaded track: {track.name}")
 
         self.parent.showMessage(f"\nLoaded {len(model.items)} tracks from {app.name} ...")
         self.parent.done()
@@ -54,13 +52,15 @@ class TrackWidget(_WidgetTemplate):
                       appA, viewA: QTableView,
                       appB, viewB: QTableView):
 
-        modelA = viewA.model()
-        modelB = viewB.model()
+        modelA = self.modelOf(viewA)
+        modelB = self.modelOf(viewB)
         
         self.parent.busy()
 
         num_items = 0
 
+        restored = self._restoreMappings('track', modelA.items, modelB, appB.get_tracks)
+
         for a_track in modelA.items:
             a_name = a_track.simplifiedName()
             a_id = a_track.id
@@ -74,8 +74,8 @@ class TrackWidget(_WidgetTemplate):
 
             # Re-use known mapping
             b_id = self.parent.mappingTable.find('track', a_id)
-            if b_id:
-                b_track = appB.get_track(b_id)
+            b_track = restored.get(b_id) if b_id else None
+            if b_track:
                 b_name = b_track.simplifiedName()
 
                 print(f"Transfer track: {a_name} ({appA.name}:{a_id}) => {b_name} ({appB.name}:{b_id}) [restored]")
@@ -84,35 +84,43 @@ class TrackWidget(_WidgetTemplate):
                 num_items += 1
                 continue
 
+            # Look up by ISRC code
+            b_track = appB.find_track_by_isrc(a_track.isrc) if a_track.isrc else None
+            if b_track:
+                b_name = b_track.simplifiedName()
+                b_id = str(b_track.id)
+
+                print(f"Transfer track: {a_name} ({appA.name}:{a_id}) => {b_name} ({appB.name}:{b_id}) [isrc]")
+                b_track.setDirty(True)  # mark as dirty to save later
+                modelB.insert(b_track)
+                num_items += 1
+                self.parent.mappingTable.add('track', a_id, b_id)
+                continue
+
             # Search by track name
             query = f"{a_track.artist} - {a_track.album} - {a_track._name}"
             print("Searching for track:", query)
             result = appB.search_track(query)
-            if not result:
+
+            # Find best matching track in search results
+            b_track, score = self.parent.matcher.bestMatch(a_track, result)
+            if b_track is None:
                 # Redo search without album name
                 query = f"{a_track.artist} - {a_track._name}"
                 print("Searching for track:", query)
                 result = appB.search_track(query)
+                b_track, score = self.parent.matcher.bestMatch(a_track, result)
 
-            # Find matching track in search results
-            match = False
-            for b_track in result:
+            match = b_track is not None
+            if match:
                 b_name = b_track.simplifiedName()
+                b_id = str(b_track.id)
 
-                # Must have exact, case-insensitive match
-                if b_track.name.lower() == a_track.name.lower() \
-                        and b_track.artist.lower() == a_track.artist.lower() \
-                        and b_track.album.lower() == a_track.album.lower():
-                    b_id = str(b_track.id)
-
-                    print(f"Transfer track: {a_name} ({appA.name}:{a_id}) => {b_name} ({appB.name}:{b_id}) [matched]")
-                    b_track.setDirty(True)  # mark as dirty to save later
-                    modelB.insert(b_track)
-                    num_items += 1
-                    self.parent.mappingTable.add('track', a_id, b_id)
-
-                    match = True
-                    break
+                print(f"Transfer track: {a_name} ({appA.name}:{a_id}) => {b_name} ({appB.name}:{b_id}) [matched {score:.2f}]")
+                b_track.setDirty(True)  # mark as dirty to save later
+                modelB.insert(b_track)
+                num_items += 1
+                self.parent.mappingTable.add('track', a_id, b_id)
 
             if not match:
                 # Allow to manually specify an track id
@@ -143,15 +151,12 @@ class TrackWidget(_WidgetTemplate):
                 else:
                     return
 
-        self.wTableModelA.layoutChanged.emit()
-        self.wTableModelB.layoutChanged.emit()
-
         self.parent.showMessage(f"\nTransferred {num_items} albums to {appB.name} ...")
         self.parent.done()
         
     def _submitData(self, app, view: QTableView):
 
-        model = view.model()
+        model = self.modelOf(view)
 
         added_tracks = []
         for item in model.items:
@@ -166,14 +171,22 @@ class TrackWidget(_WidgetTemplate):
 
         #print(added_tracks)
         print(f"Adding {len(added_tracks)} tracks to {app.name} ...")
-        app.add_saved_tracks(added_tracks)
-
-        dlg = MessageDialog(self, "Success!",
-            f"{len(added_tracks)} track(s) were added to {app.name}.")
+        submitted, failed = app.add_saved_tracks(added_tracks)
+
+        # only confirmed tracks are saved, failed ones stay dirty for the next submit
+        for track in submitted:
+            track.setDirty(False)
+        model.updateStatus([ track.simplifiedName() for track in submitted ])
+
+        if failed:
+            dlg = MessageDialog(self, "Warning!",
+                f"{len(submitted)} track(s) were added to {app.name}, {len(failed)} track(s) failed.")
+        else:
+            dlg = MessageDialog(self, "Success!",
+                f"{len(submitted)} track(s) were added to {app.name}.")
         dlg.exec()
 
-        self._loadData(app, view)
+        self.parent.showMessage(f"\nSubmtited {len(submitted)} tracks to {app.name} ...")
 
-        self.parent.showMessage(f"\nSubmtited {len(added_tracks)} tracks to {app.name} ...")
         self.parent.done()
         
\ No newline at end of file
@@ -1,16 +1,26 @@
 from threading import Thread
-from PyQt6.QtCore import Qt, QPoint
+from PyQt6.QtCore import Qt, QPoint, QModelIndex, pyqtSignal
 from PyQt6.QtWidgets import *
 
-from item_models import _ModelTemplate
+from item_models import _ModelTemplate, ItemFilterProxyModel
 
 #############################################################################
 
 class _WidgetTemplate(QWidget):
+
+    SNAPSHOT_KIND = None  # kind of items in the app's library snapshot, see restoreAData()
+
+    pageLoaded = pyqtSignal(object, object, object, object)  # app, view, token, items, None when done or exception
+    revalidated = pyqtSignal(object, object, object, object)  # app, view, token, items or exception
+
     def __init__(self, parent):
         super().__init__()
 
         self.parent = parent
+        self.loading = {}  # id(view) -> token of the running load
+        self.revalidating = {}  # id(view) -> token of the running revalidation
+        self.pageLoaded.connect(self._pageLoaded)
+        self.revalidated.connect(self._revalidated)
 
         # middle buttons
         self.wButtonLoadA = QPushButton('🡄 Load')
@@ -52,8 +62,15 @@ class _WidgetTemplate(QWidget):
         self.wTableViewA.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         self.wTableViewA.setSortingEnabled(True)
         
-        self.wTableModelA = _ModelTemplate()   
-        self.wTableViewA.setModel(self.wTableModelA)
+        self.wTableModelA = _ModelTemplate()
+        self.wTableProxyA = ItemFilterProxyModel()
+        self.wTableProxyA.setSourceModel(self.wTableModelA)
+        self.wTableViewA.setModel(self.wTableProxyA)
+
+        self.wFilterA = QLineEdit()
+        self.wFilterA.setPlaceholderText("Filter ...")
+        self.wFilterA.setClearButtonEnabled(True)
+        self.wFilterA.textChanged.connect(self.wTableProxyA.setFilterText)
 
         self.wLabelA = QLabel()
         self.wLabelA.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -61,6 +78,7 @@ class _WidgetTemplate(QWidget):
 
         self.wLayoutA = QVBoxLayout()
         self.wLayoutA.addWidget(self.wLabelA)
+        self.wLayoutA.addWidget(self.wFilterA)
         self.wLayoutA.addWidget(self.wTableViewA)
 
         # right table
@@ -70,8 +88,15 @@ class _WidgetTemplate(QWidget):
         self.wTableViewB.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         self.wTableViewB.setSortingEnabled(True)
         
-        self.wTableModelB = _ModelTemplate()  
-        self.wTableViewB.setModel( self.wTableModelB)
+        self.wTableModelB = _ModelTemplate()
+        self.wTableProxyB = ItemFilterProxyModel()
+        self.wTableProxyB.setSourceModel(self.wTableModelB)
+        self.wTableViewB.setModel(self.wTableProxyB)
+
+        self.wFilterB = QLineEdit()
+        self.wFilterB.setPlaceholderText("Filter ...")
+        self.wFilterB.setClearButtonEnabled(True)
+        self.wFilterB.textChanged.connect(self.wTableProxyB.setFilterText)
 
         self.wLabelB = QLabel()
         self.wLabelB.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -79,6 +104,7 @@ class _WidgetTemplate(QWidget):
 
         self.wLayoutB = QVBoxLayout()
         self.wLayoutB.addWidget(self.wLabelB)
+        self.wLayoutB.addWidget(self.wFilterB)
         self.wLayoutB.addWidget(self.wTableViewB)
 
         # signals
@@ -88,9 +114,15 @@ class _WidgetTemplate(QWidget):
     def reset(self):
         """Clear table data and reset widgets."""
 
+        self.loading.clear()
+        if self._cancelRevalidation(self.wTableViewA) | self._cancelRevalidation(self.wTableViewB):
+            self.parent.done()
         self.wTableModelA.clear()
         self.wTableModelB.clear()
 
+        self.wTableViewA.sortByColumn(self.wTableModelA.DEFAULT_SORT_COLUMN, Qt.SortOrder.AscendingOrder)
+        self.wTableViewB.sortByColumn(self.wTableModelB.DEFAULT_SORT_COLUMN, Qt.SortOrder.AscendingOrder)
+
         if self.parent.appA:
             self.wLabelA.setText(self.parent.appA.name)
         if self.parent.appB:
@@ -118,6 +150,16 @@ class _WidgetTemplate(QWidget):
         t = Thread(self._loadData(self.parent.appB, self.wTableViewB))
         t.start()
 
+    def restoreAData(self):
+        """Show A table from the library snapshot."""
+
+        self._restoreData(self.parent.appA, self.wTableViewA)
+
+    def restoreBData(self):
+        """Show B table from the library snapshot."""
+
+        self._restoreData(self.parent.appB, self.wTableViewB)
+
     def transferAToB(self):
         """Transfer items from A to B."""
 
@@ -156,23 +198,193 @@ class _WidgetTemplate(QWidget):
         t = Thread(self._submitData(self.parent.appB, self.wTableViewB))
         t.start()
 
-    def _scrollTable(self, viewA: QTableView, viewB: QTableView):
+    def setModels(self, modelA: _ModelTemplate, modelB: _ModelTemplate):
+        """Set the item models shown in the A/B tables."""
+
+        self.wTableModelA = modelA
+        self.wTableProxyA.setSourceModel(self.wTableModelA)
+
+        self.wTableModelB = modelB
+        self.wTableProxyB.setSourceModel(self.wTableModelB)
+
+        self.wTableModelA.setSiblingModel(self.wTableModelB)
+        self.wTableModelB.setSiblingModel(self.wTableModelA)
+
+    @staticmethod
+    def modelOf(view: QTableView):
+        """Return the item model behind a view (bypassing any filter proxy)."""
+
+        model = view.model()
+        if isinstance(model, ItemFilterProxyModel):
+            return model.sourceModel()
+        return model
 
-        modelA = viewA.model()
-        modelB = viewB.model()
+    @staticmethod
+    def sourceRow(view: QTableView, index: QModelIndex):
+        """Map a view index to a row of the item model."""
 
-        a_row = viewA.indexAt(QPoint(0, 0)).row()  # top row
-        if a_row:
-            name = modelA.names[a_row]
-            if name in modelB.names:
-                b_row = modelB.names.index(name)
-                if b_row:
-                    viewB.scrollTo(modelB.createIndex(b_row, 0))
+        model = view.model()
+        if isinstance(model, ItemFilterProxyModel):
+            index = model.mapToSource(index)
+        return index.row()
+
+    @staticmethod
+    def viewIndex(view: QTableView, row: int):
+        """Map a row of the item model to a view index (invalid if filtered out)."""
+
+        model = view.model()
+        if isinstance(model, ItemFilterProxyModel):
+            return model.mapFromSource(model.sourceModel().index(row, 0))
+        return model.index(row, 0)
+
+    def _scrollTable(self, viewA: QTableView, viewB: QTableView):
+
+        modelA = self.modelOf(viewA)
+        modelB = self.modelOf(viewB)
+
+        a_index = viewA.indexAt(QPoint(0, 0))  # top row
+        if a_index.isValid():
+            name = modelA.names[self.sourceRow(viewA, a_index)]
+            b_row = modelB.findRow(name)
+            if b_row is not None:
+                b_index = self.viewIndex(viewB, b_row)
+                if b_index.isValid():
+                    viewB.scrollTo(b_index)
                     viewB.update()
 
+    def _restoreMappings(self, type: str, items: list, model: _ModelTemplate, get_items):
+        """Resolve the known mappings of all items that are not in `model` yet
+        with one batched `get_items(ids)` call. Returns a dict of id -> item."""
+
+        ids = {}  # ordered set
+        for item in items:
+            if model.find(item.simplifiedName()) is None:
+                b_id = self.parent.mappingTable.find(type, item.id)
+                if b_id:
+                    ids[b_id] = None
+
+        if not ids:
+            return {}
+
+        return { b_id: item
+                for b_id, item in zip(ids, get_items(list(ids)))
+                if item is not None }
+
+    def _loadPages(self, app, view: QTableView, pages):
+        """Populate the view's model from a page stream. The pages are fetched
+        in a background thread and each one is shown as soon as it arrives."""
+
+        self._cancelRevalidation(view)  # the load reports when it is done
+
+        token = object()
+        self.loading[id(view)] = token
+
+        t = Thread(target=self._fetchPages, args=(app, view, token, pages), daemon=True)
+        t.start()
+
+    def _fetchPages(self, app, view: QTableView, token, pages):
+        try:
+            for page in pages:
+                if self.loading.get(id(view)) is not token:
+                    return  # superseded, stop fetching
+                self.pageLoaded.emit(app, view, token, page)
+        except Exception as e:
+            self.pageLoaded.emit(app, view, token, e)
+            return
+        self.pageLoaded.emit(app, view, token, None)
+
+    def _pageLoaded(self, app, view: QTableView, token, page):
+        if self.loading.get(id(view)) is not token:
+            return  # superseded by another load, or the table was reset
+
+        if page is not None and not isinstance(page, Exception):
+            self.modelOf(view).extend(page)
+            return
+
+        del self.loading[id(view)]
+
+        if isinstance(page, Exception):
+            self.parent.showMessage(f"\nCould not load {app.name} data: {page}")
+            self.parent.done()
+            return
+
+        # apply current sort order to the complete table
+        header = view.horizontalHeader()
+        view.sortByColumn(header.sortIndicatorSection(), header.sortIndicatorOrder())
+
+        self._loadFinished(app, view)
+
+    def _restoreData(self, app, view: QTableView):
+        """Show the items of the app's library snapshot right away, then reload
+        them in the background and apply only the differences."""
+
+        items = app.snapshot_items(self.SNAPSHOT_KIND) if app and self.SNAPSHOT_KIND else None
+        if not items:
+            return
+
+        self.loading.pop(id(view), None)
+
+        model = self.modelOf(view)
+        model.clear()
+        model.extend(items)
+
+        header = view.horizontalHeader()
+        view.sortByColumn(header.sortIndicatorSection(), header.sortIndicatorOrder())
+
+        print(f"\nRevalidating {len(items)} {app.name} {self.SNAPSHOT_KIND} ...")
+
+        token = object()
+        self.revalidating[id(view)] = token
+        self.parent.revalidationStarted()
+
+        # fetch in the background, the result is applied on the GUI thread by _revalidated()
+        t = Thread(target=self._fetchRevalidation, args=(app, view, token), daemon=True)
+        t.start()
+
+    def _fetchRevalidation(self, app, view: QTableView, token):
+        try:
+            result = [ item for page in self._iterPages(app) for item in page ]
+        except Exception as e:
+            result = e
+        self.revalidated.emit(app, view, token, result)
+
+    def _revalidated(self, app, view: QTableView, token, result):
+        if self.revalidating.get(id(view)) is not token:
+            return  # superseded by a load, or the table was reset
+
+        del self.revalidating[id(view)]
+        self.parent.revalidationFinished()
+
+        if isinstance(result, Exception):
+            # keep showing the snapshot, e.g. when offline
+            self.parent.showMessage(f"\nCould not revalidate {app.name} {self.SNAPSHOT_KIND}: {result}")
+            self.parent.done()
+            return
+
+        self.modelOf(view).sync(result)
+        header = view.horizontalHeader()
+        view.sortByColumn(header.sortIndicatorSection(), header.sortIndicatorOrder())
+
+        self._loadFinished(app, view)
+
+    def _cancelRevalidation(self, view: QTableView):
+        """Forget a running revalidation of the view, returns True if there was one."""
+
+        if self.revalidating.pop(id(view), None) is None:
+            return False
+
+        self.parent.revalidationFinished()
+        return True
+
+    def _iterPages(self, app):
+        return []
+
     def _loadData(self, app, view: QTableView):
         return
 
+    def _loadFinished(self, app, view: QTableView):
+        return
+
     def _transferData(self, appA, viewA: QTableView, appB, viewB: QTableView):
         return
 